@@ -0,0 +1,342 @@
+"""
+    Decodes ABI encoded calldata and event data. A decoder is compiled once per list of
+    canonical types and cached, so the calls and events of every candidate transaction
+    can be decoded without parsing the ABI again
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from errors import DecodeError, TypeNotFound
+from signatures import get_canonical_type
+
+
+def read_word(data: bytes, pos: int) -> bytes:
+    if pos < 0 or pos + 32 > len(data):
+        raise DecodeError(f"read of 32 bytes at {pos} past the end of the data")
+
+    return data[pos:pos + 32]
+
+
+def read_uint(data: bytes, pos: int) -> int:
+    return int.from_bytes(read_word(data, pos), "big")
+
+
+class UintDecoder():
+    """
+        Decodes intN and uintN values into ints
+    """
+
+    dynamic = False
+    size = 32
+
+    def __init__(self, signed: bool) -> None:
+        self.signed = signed
+
+    def decode(self, data: bytes, pos: int) -> int:
+        return int.from_bytes(read_word(data, pos), "big", signed=self.signed)
+
+
+class AddressDecoder():
+    """
+        Decodes addresses into lowercase 0x prefixed strings, matching the traces
+    """
+
+    dynamic = False
+    size = 32
+
+    def decode(self, data: bytes, pos: int) -> str:
+        return "0x" + read_word(data, pos)[12:].hex()
+
+
+class BoolDecoder():
+    dynamic = False
+    size = 32
+
+    def decode(self, data: bytes, pos: int) -> bool:
+        return read_uint(data, pos) != 0
+
+
+class FixedBytesDecoder():
+    """
+        Decodes bytesN values into N raw bytes
+    """
+
+    dynamic = False
+    size = 32
+
+    def __init__(self, length: int) -> None:
+        self.length = length
+
+    def decode(self, data: bytes, pos: int) -> bytes:
+        return read_word(data, pos)[:self.length]
+
+
+class BytesDecoder():
+    """
+        Decodes the dynamic bytes and string types
+    """
+
+    dynamic = True
+    size = 32
+
+    def __init__(self, string: bool) -> None:
+        self.string = string
+
+    def decode(self, data: bytes, pos: int) -> bytes | str:
+        length = read_uint(data, pos)
+
+        if pos + 32 + length > len(data):
+            raise DecodeError(f"bytes of length {length} at {pos} past the end of the data")
+
+        value = data[pos + 32:pos + 32 + length]
+
+        return value.decode("utf-8", errors="replace") if self.string else value
+
+
+class TupleDecoder():
+    """
+        Decodes a tuple (or the arguments of a function / event) from the head and tail
+        encoding of its components
+    """
+
+    def __init__(self, components: List[object]) -> None:
+        self.components = components
+
+        self.dynamic = any(i.dynamic for i in components)
+        self.size = 32 if self.dynamic else sum(i.size for i in components)
+
+    def decode(self, data: bytes, pos: int) -> tuple:
+        return tuple(decode_components(self.components, data, pos))
+
+
+class ArrayDecoder():
+    """
+        Decodes fixed size T[k] and dynamic T[] arrays into lists
+    """
+
+    def __init__(self, item: object, length: int = None) -> None:
+        self.item = item
+        self.length = length
+
+        self.dynamic = length is None or item.dynamic
+        self.size = 32 if self.dynamic else length * item.size
+
+    def decode(self, data: bytes, pos: int) -> list:
+        length = self.length
+
+        if length is None:
+            length = read_uint(data, pos)
+            pos += 32
+
+        if pos + length * self.item.size > len(data):
+            raise DecodeError(f"array of length {length} at {pos} past the end of the data")
+
+        return decode_components([self.item] * length, data, pos)
+
+
+def decode_components(components: List[object], data: bytes, base: int) -> list:
+    '''
+        Decodes consecutive components starting at base. Static components are encoded in
+        place, while dynamic components hold the offset of their tail relative to base
+    '''
+    values = []
+    pos = base
+
+    for component in components:
+        if component.dynamic:
+            values.append(component.decode(data, base + read_uint(data, pos)))
+        else:
+            values.append(component.decode(data, pos))
+
+        pos += component.size
+
+    return values
+
+
+def split_components(types: str) -> List[str]:
+    '''
+        Splits the comma separated components of a tuple type, ignoring nested tuples
+    '''
+    if types == "":
+        return []
+
+    res = []
+    depth = 0
+    start = 0
+
+    for i, c in enumerate(types):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            res.append(types[start:i])
+            start = i + 1
+
+    res.append(types[start:])
+
+    return res
+
+
+@lru_cache(maxsize=4096)
+def compile_type(_type: str) -> object:
+    '''
+        Compiles a decoder for a canonical type, such as uint256, (address,bytes)[] or bytes32[2]
+
+        @param _type : the canonical type to decode
+
+        @returns the decoder of the type
+    '''
+    if _type.endswith("]"):
+        i = _type.rindex("[")
+        length = _type[i + 1:-1]
+
+        return ArrayDecoder(compile_type(_type[:i]), int(length) if length != "" else None)
+
+    if _type.startswith("("):
+        return TupleDecoder([compile_type(i) for i in split_components(_type[1:-1])])
+
+    if _type == "address":
+        return AddressDecoder()
+    elif _type == "bool":
+        return BoolDecoder()
+    elif _type == "bytes":
+        return BytesDecoder(string=False)
+    elif _type == "string":
+        return BytesDecoder(string=True)
+    elif _type == "function":
+        return FixedBytesDecoder(24)
+    elif _type.startswith("bytes"):
+        return FixedBytesDecoder(int(_type[5:]))
+    elif _type.startswith("uint") or _type.startswith("int"):
+        return UintDecoder(signed=_type.startswith("int"))
+
+    raise TypeNotFound(_type)
+
+
+@lru_cache(maxsize=4096)
+def compile_event(types: Tuple[str], indexed: Tuple[bool]) -> Tuple[TupleDecoder, List[object]]:
+    '''
+        Compiles the decoders of an event, one decoding the non-indexed arguments from the
+        data, and one per indexed argument decoding its topic
+    '''
+    data = TupleDecoder([compile_type(t)
+                        for t, i in zip(types, indexed) if not i])
+    topics = [compile_type(t) for t, i in zip(types, indexed) if i]
+
+    return data, topics
+
+
+def decode_args(params: List[Dict[str, object]], data: bytes) -> List[object]:
+    '''
+        Decodes ABI encoded arguments, such as the calldata of a function without its selector
+
+        @param params : the ABI inputs (or outputs) of the function
+        @param data : the encoded arguments
+
+        @returns the decoded value of each parameter, in order
+    '''
+    decoder = compile_type(
+        f"({','.join(get_canonical_type(i) for i in params)})")
+
+    return decoder.decode(data, 0)
+
+
+def is_hashed(decoder: object) -> bool:
+    '''
+        Returns whether an indexed argument of the decoded type is logged as the hash of its value
+    '''
+    return decoder.dynamic or isinstance(decoder, (TupleDecoder, ArrayDecoder))
+
+
+def decode_event(params: List[Dict[str, object]], topics: List[bytes], data: bytes) -> List[object]:
+    '''
+        Decodes the arguments of an event from its topics and data. Indexed arguments of a
+        dynamic or non-elementary type (strings, bytes, tuples and arrays) are only logged as
+        the keccak256 hash of their value, so the raw 32 byte topic is returned for them
+
+        @param params : the ABI inputs of the event
+        @param topics : the topics of the logged event, including topic0
+        @param data : the non-indexed data of the logged event
+
+        @returns the decoded value of each parameter, in order
+    '''
+    indexed = tuple(bool(i.get('indexed')) for i in params)
+    data_decoder, topic_decoders = compile_event(
+        tuple(get_canonical_type(i) for i in params), indexed)
+
+    if len(topics) - 1 < len(topic_decoders):
+        raise DecodeError(f"expected {len(topic_decoders)} indexed topics, got {len(topics) - 1}")
+
+    unindexed = iter(data_decoder.decode(data, 0))
+    indexed_topics = iter(zip(topic_decoders, topics[1:]))
+
+    values = []
+
+    for i in indexed:
+        if i:
+            decoder, topic = next(indexed_topics)
+            values.append(topic if is_hashed(decoder) else decoder.decode(topic, 0))
+        else:
+            values.append(next(unindexed))
+
+    return values
+
+
+def decode_signature(signature: str, data: bytes) -> List[object]:
+    '''
+        Decodes ABI encoded arguments from a text signature alone, such as
+        transfer(address,uint256), for calls of contracts without a known ABI
+    '''
+    return compile_type(signature[signature.index("("):]).decode(data, 0)
+
+
+def decode_event_signature(signature: str, topics: List[bytes], data: bytes) -> List[object]:
+    '''
+        Decodes the arguments of an event from a text signature alone. A text signature does
+        not say which arguments are indexed, so the first len(topics) - 1 arguments are taken
+        as indexed, as is the case for most events
+    '''
+    types = tuple(split_components(signature[signature.index("(") + 1:-1]))
+    indexed = tuple(i < len(topics) - 1 for i in range(len(types)))
+
+    if len(topics) - 1 > len(types):
+        raise DecodeError(f"{signature} has fewer arguments than indexed topics")
+
+    return decode_event([{'type': t, 'indexed': i} for t, i in zip(types, indexed)], topics, data)
+
+
+def normalize_name(name: str) -> str:
+    return name.lstrip("_").lower()
+
+
+def name_values(params: List[Dict[str, object]], values: List[object], names: List[str] = None) -> Dict[str, object]:
+    '''
+        Maps decoded values to field names. Without names, the ABI parameter names are used.
+        Otherwise each name is matched to the parameter of the same name (ignoring leading
+        underscores and case, so receiver matches _receiver), falling back to its position
+        when there are as many names as parameters. Names without a parameter are left out
+
+        @param params : the ABI parameters the values were decoded from
+        @param values : the decoded values
+        @param names : the field names to use, such as a parameter list of the bridge input file
+    '''
+    if names is None:
+        return {i.get('name') or str(pos): v for pos, (i, v) in enumerate(zip(params, values))}
+
+    locations = {normalize_name(i.get('name', '')): pos
+                 for pos, i in enumerate(params)}
+
+    res = {}
+
+    for pos, name in enumerate(names):
+        location = locations.get(normalize_name(name))
+
+        if location is None and len(names) == len(params):
+            location = pos
+
+        if location is not None:
+            res[name] = values[location]
+
+    return res
@@ -0,0 +1,182 @@
+"""
+    Defines a local, per-chain index of block numbers to block timestamps, used to align
+    blocks across chains without going through the *Scan APIs
+"""
+
+import argparse
+import os
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Tuple
+
+import requests
+
+BLOCKINDEX = "./blockindex"
+
+
+class BlockIndex():
+    """
+        Index of block -> timestamp for a single chain, kept as two sorted, parallel arrays of
+        32 bit unsigned integers and stored on disk at {directory}/{chain}.blocks. The index is
+        filled incrementally, either from a node's JSON-RPC api via fill_from_rpc or from the
+        *Scan responses recorded by the ContractStore
+
+        Params:
+        - chain: the name of the chain of the index (eth, bsc, poly)
+        - directory: the directory to store the index in (default ./blockindex)
+    """
+
+    def __init__(self, chain: str, directory: str = BLOCKINDEX) -> None:
+        self.chain = chain
+        self.filepath = os.path.join(directory, f"{chain}.blocks")
+
+        self.blocks = array("I")
+        self.timestamps = array("I")
+
+        self.dirty = False
+
+        self.__load()
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def __load(self) -> None:
+        """
+            Loads the index from disk if it exists. The file holds the blocks array
+            followed by the timestamps array
+        """
+        if not os.path.exists(self.filepath):
+            return
+
+        with open(self.filepath, "rb") as f:
+            data = f.read()
+
+        half = len(data) // 2
+
+        self.blocks.frombytes(data[:half])
+        self.timestamps.frombytes(data[half:])
+
+    def save(self) -> None:
+        """
+            Writes the index to disk if it has changed since it was loaded
+        """
+        if not self.dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.filepath) or ".", exist_ok=True)
+
+        tmp = f"{self.filepath}.tmp"
+
+        with open(tmp, "wb") as f:
+            self.blocks.tofile(f)
+            self.timestamps.tofile(f)
+
+        os.replace(tmp, self.filepath)
+
+        self.dirty = False
+
+    def add(self, block: int, timestamp: int) -> None:
+        '''
+            Records the timestamp of a block in the index
+
+            @param block : the block number
+            @param timestamp : the Unix timestamp the block was minted at
+        '''
+        i = bisect_left(self.blocks, block)
+
+        if i < len(self.blocks) and self.blocks[i] == block:
+            self.timestamps[i] = timestamp
+        elif i == len(self.blocks):
+            self.blocks.append(block)
+            self.timestamps.append(timestamp)
+        else:
+            self.blocks.insert(i, block)
+            self.timestamps.insert(i, timestamp)
+
+        self.dirty = True
+
+    def add_many(self, blocks: Iterable[Tuple[int, int]]) -> None:
+        '''
+            Records multiple (block, timestamp) pairs, appending directly to the arrays
+            while the blocks are past the end of the index
+        '''
+        for block, timestamp in sorted(blocks):
+            if len(self.blocks) == 0 or block > self.blocks[-1]:
+                self.blocks.append(block)
+                self.timestamps.append(timestamp)
+                self.dirty = True
+            else:
+                self.add(block, timestamp)
+
+    def get_timestamp(self, block: int) -> int | None:
+        '''
+            Returns the timestamp of a block, or None if the block is not indexed
+        '''
+        i = bisect_left(self.blocks, block)
+
+        if i < len(self.blocks) and self.blocks[i] == block:
+            return self.timestamps[i]
+
+        return None
+
+    def get_closest_block(self, timestamp: int) -> int | None:
+        '''
+            Returns the first block minted at or after the timestamp, matching the
+            *Scan getblocknobytime closest=after lookup. The result is only returned
+            if the block directly before it is indexed too, otherwise an unindexed
+            block could be the actual answer and None is returned
+
+            @param timestamp : the Unix timestamp to search for
+
+            @returns the block number, or None if the index cannot answer the lookup
+        '''
+        i = bisect_left(self.timestamps, timestamp)
+
+        if i == 0 or i == len(self.blocks):
+            return None
+
+        if self.blocks[i - 1] != self.blocks[i] - 1:
+            return None
+
+        return self.blocks[i]
+
+    def fill_from_rpc(self, rpc_url: str, start: int, end: int, batch_size: int = 100) -> None:
+        '''
+            Fills the index with the blocks from start to end (inclusive) through
+            batched eth_getBlockByNumber calls against a node's JSON-RPC api
+
+            @param rpc_url : the url of the node
+            @param start : the first block to index
+            @param end : the last block to index
+            @param batch_size : the number of blocks to request per JSON-RPC batch (default 100)
+        '''
+        with requests.Session() as session:
+            for batch_start in range(start, end + 1, batch_size):
+                batch = [{"jsonrpc": "2.0", "id": n, "method": "eth_getBlockByNumber", "params": [hex(n), False]}
+                         for n in range(batch_start, min(batch_start + batch_size, end + 1))]
+
+                res = session.post(rpc_url, json=batch).json()
+
+                self.add_many((int(i['result']['number'], 16), int(i['result']['timestamp'], 16))
+                              for i in res if i.get('result') is not None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fills the local block index of a chain from a node's JSON-RPC api")
+    parser.add_argument('-c', '--chain', type=str, required=True,
+                        help="The chain of the index (eth, bsc, poly)")
+    parser.add_argument('-r', '--rpc', type=str, required=True,
+                        help="The url of the node's JSON-RPC api")
+    parser.add_argument('-s', '--start', type=int, required=True,
+                        help="The first block to index")
+    parser.add_argument('-e', '--end', type=int, required=True,
+                        help="The last block to index")
+    parser.add_argument('-d', '--directory', type=str, default=BLOCKINDEX,
+                        help="The directory of the block index, default ./blockindex")
+
+    args = parser.parse_args()
+
+    index = BlockIndex(args.chain, args.directory)
+    index.fill_from_rpc(args.rpc, args.start, args.end)
+    index.save()
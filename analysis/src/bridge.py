@@ -1,13 +1,33 @@
 from contract import Contract, Function, Event
 from contractstore import ContractStore
-from mgowrapper import MongoFetcher
-from transaction import Transaction, CrossChainSend
+from mgowrapper import MongoFetcher, get_call_pattern, get_calls_query
+from transaction import Transaction, CrossChainSend, SrcEvents, DestEvents
+from linker import link_by_transfer_id, link_asof, IncrementalLinker
+from windowcache import WindowCache
+from latency import LatencyProfile
+from scheduler import Priority
+from errors import MongoTxNotFound
 import json
+import re
 from enum import IntEnum, Enum
 from collections import defaultdict
 import pandas as pd
 
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Tuple
+
+
+SRC_COLUMNS = ['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr',
+               'srcChainId', 'srcValue', 'destChainId', 'destReceiver', 'transferId']
+DEST_COLUMNS = ['destHash', 'destSender', 'destReceiver',
+                'destTokenAddr', 'destChainId', 'destValue', 'transferId']
+LINKED_COLUMNS = ['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId',
+                  'destReceiver', 'destHash', 'destSender', 'destTokenAddr', 'destValue', 'transferId']
+
+# the blocks of a linked send and relay, kept on .linked_tx for record_latencies but not output
+BLOCK_COLUMNS = ['srcBlock', 'destBlock']
+
+# the number of times link_incremental looks up the timestamp of a send or relay
+UNTIMED_ATTEMPTS = 3
 
 
 class Chains(IntEnum):
@@ -32,7 +52,7 @@ class Chains(IntEnum):
         if name == Chains.ETH:
             return "eth"
         elif name == Chains.POLYGON:
-            return "polygon"
+            return "poly"
         elif name == Chains.BSC:
             return "bsc"
 
@@ -44,8 +64,12 @@ class Endpoint():
         one for each chain
     '''
 
-    def __init__(self, chain: Chains, address: str, db: MongoFetcher, store: ContractStore, dest_functions, src_functions, dest_events, src_events) -> None:
-        self.address = address
+    def __init__(self, chain: Chains, address: str, db: MongoFetcher, store: ContractStore, dest_functions, src_functions, dest_events, src_events,
+                 window_cache: WindowCache = None) -> None:
+        # traces are parsed with lowercase addresses, see MongoFetcher.get_block_range for the
+        # checksummed top level "to" of the documents
+        self.address = address.lower()
+
         self.store = store
         self.contract = self.store.get_contract(address)
         self.db = db
@@ -58,11 +82,17 @@ class Endpoint():
         self.src_events: List[Event] = []
         self.dest_events: List[Event] = []
 
+        # the field names of each function / event's parameters, from the bridge input file
+        self.param_names: Dict[str, List[str]] = {}
+
         self.src_tx: CrossChainSend = None
         self.dest_tx: List[Transaction] = []
 
         self.invalid_tx: List[Transaction] = []
 
+        # optional cache of the destination candidates of already scanned block ranges
+        self.window_cache = window_cache
+
         self.__load(dest_functions, src_functions,
                     dest_events, src_events)
 
@@ -102,35 +132,82 @@ class Endpoint():
         for e in src_events:
             self.src_events.append(self.contract.get_event(next(iter(e))))
 
-    def load_src_transaction(self, tx: str) -> None:
+        for i in [*dest_funcs, *src_funcs, *dest_events, *src_events]:
+            self.param_names.update(i)
+
+        # regex of a functrace row calling an outbound function, see get_call_pattern
+        self.src_pattern = get_call_pattern(
+            self.address, [f.signature for f in self.src_funcs])
+        self.src_probe = re.compile(self.src_pattern, re.IGNORECASE)
+
+    def is_src_candidate(self, functrace: str) -> bool:
+        """
+            Cheaply checks whether a raw functrace calls one of the outbound functions of the
+            endpoint, without parsing the trace or loading any contracts
+
+            @param functrace: the functrace field of a transaction document
+        """
+        return self.src_probe.search(functrace) is not None
+
+    def load_src_transaction(self, tx: str, data: dict = None) -> None:
         """
             Loads in a singular src transaction from a tx hash. If the transaction interacts
             with an outbound function (send/sendNative), self.src_tx is set to the Transaction 
             object, else it remains None
 
             @param tx: the tx hash to load on the source chain
+            @param data: the already fetched document of the transaction, if any
         """
 
-        tx_query = self.db.get_tx(tx)
+        tx = Transaction(tx, self.db, self.store, lazy=True, data=data)
 
-        tx = Transaction(tx_query['tx'], self.db, self.store)
+        # only fetch and parse the traces if the transaction can be a send at all
+        if data is not None and 'functrace' in data:
+            if not self.is_src_candidate(data['functrace']):
+                return
+        elif not tx.may_call(self.address, [func.signature for func in self.src_funcs]):
+            return
 
         for func in self.src_funcs:
             if tx.contains_function(self.address, func.signature) and tx.is_token_transfer:
                 self.src_tx = tx
 
+    def get_src_args(self, tx: Transaction = None) -> Dict[str, object] | None:
+        """
+            Decodes the arguments of the outbound function call of a source transaction (default
+            the loaded src_tx) into the field names of the bridge input file, such as receiver
+            and dstChainId
+        """
+        tx = tx or self.src_tx
+
+        if tx is None:
+            return None
+
+        for func in self.src_funcs:
+            args = tx.get_function_args(
+                self.address, func, self.param_names.get(func.name))
+
+            if args is not None:
+                return args
+
+        return None
+
     def get_src_transaction_chain(self) -> Chains:
         """
-            Determines
+            Determines the destination chain of the source transaction from the dstChainId
+            argument of its outbound function call
         """
-        if self.src_tx is None:
-            return 0
+        args = self.get_src_args()
 
-        chain_id = self.src_tx.get_function_value(3)
+        if args is None or 'dstChainId' not in args:
+            return 0
 
-        return Chains(chain_id)
+        try:
+            return Chains(args['dstChainId'])
+        except ValueError:
+            return 0
 
-    def load_dest_transactions(self, start_block: int, end_block: int, amount: int = 100) -> None:
+    def load_dest_transactions(self, start_block: int, end_block: int, amount: int = 100, batch_size: int = 100) -> None:
         """
             Loads all transactions that invoke the output signature within a specified
             range of blocks. In this step, the only checked parameters are that the Relay / dest_funcs
@@ -138,17 +215,52 @@ class Endpoint():
 
             @param start_block : the block to start searching at
             @param end_block : the block to end searching at
-            @param amount : the number of individual transactions to scan (default 100)
+            @param amount : the number of individual transactions to scan (default 100, 0 for no limit)
+            @param batch_size : the number of transactions fetched per mongodb round trip (default 100)
+        """
+
+        if self.window_cache is None:
+            self.dest_tx.extend(self.__fetch_dest_transactions(
+                start_block, end_block, amount, batch_size)[0])
+            return
+
+        # nearby sends have overlapping windows, so only the blocks not scanned yet are fetched
+        candidates = self.window_cache.get((self.chain, self.address), start_block, end_block,
+                                           lambda start, end: self.__fetch_dest_transactions(start, end, amount, batch_size))
+
+        self.dest_tx.extend(candidates[:amount] if amount > 0 else candidates)
+
+    def __fetch_dest_transactions(self, start_block: int, end_block: int, amount: int, batch_size: int) -> Tuple[List[Transaction], bool]:
+        """
+            Fetches the transactions calling a dest_func within a range of blocks, and whether
+            the range was scanned completely (the query was not cut off at amount documents, 0
+            being no limit)
         """
+        dest_sigs = [func.signature for func in self.dest_funcs]
 
-        txs = self.db.get_block_range(
-            start_block, end_block, self.address, amount)
+        # the relay calls are matched within mongodb and the matching documents are
+        # returned in full, so each candidate is fetched exactly once
+        docs = list(self.db.get_block_range(
+            start_block, end_block, self.address, amount, projection={"_id": 0}, batch_size=batch_size, selectors=dest_sigs))
 
-        for tx_hash in txs:
-            tx = Transaction(tx_hash['tx'], self.db, self.store)
-            for func in self.dest_funcs:
-                if tx.contains_function(self.address, func.signature) and tx.is_token_transfer:
-                    self.dest_tx.append(tx)
+        res = []
+
+        for doc in docs:
+            tx = Transaction(doc['tx'], self.db, self.store, data=doc)
+
+            if tx.is_token_transfer and any(tx.contains_function(self.address, func.signature) for func in self.dest_funcs):
+                res.append(tx)
+
+        return res, amount == 0 or len(docs) < amount
+
+    def reset(self) -> None:
+        """
+            Clears the loaded source and destination transactions, so that the endpoint
+            can be reused for the next transaction of a batch
+        """
+        self.src_tx = None
+        self.dest_tx = []
+        self.invalid_tx = []
 
     def get_dest_transactions(self) -> List[Transaction]:
         return self.dest_tx
@@ -173,69 +285,184 @@ class Endpoint():
 
         for tx in self.dest_tx:
             for event in self.dest_events:
-                data = tx.get_event_data(self.address, event_sig)
-                if len(data) < 4:
-                    continue
+                args = tx.get_event_args(
+                    self.address, event, self.param_names.get(event.name))
 
-                _, _from, _to, token_addr, amount, *_ = data
+                if args is None or not {'sender', 'receiver', 'token', 'amount'} <= args.keys():
+                    continue
 
-                temp[tx.hash] = [tx.hash, _from, _to,
-                                 token_addr, int(self.chain), int(amount, 16)]
+                temp[tx.hash] = [tx.hash, args['sender'], args['receiver'],
+                                 args['token'], int(self.chain), args['amount']]
 
         return pd.DataFrame.from_dict(temp, orient='index', columns=['destHash', 'destSender', 'destReceiver', 'destTokenAddr', 'destChainId', 'destValue'])
 
+    def get_transfer_id(self, tx: Transaction, events: List[Event], field: str) -> str | None:
+        '''
+            Returns the transfer id a transaction carries in one of the passed events of the
+            endpoint, such as the transferId of a Send or the srcTransferID of a Relay
+
+            @param tx : the transaction to decode the events of
+            @param events : the events of the endpoint that carry the id
+            @param field : the field name of the id, from the bridge input file
+
+            @returns the id as a 0x prefixed hex string, or None if no event carries it
+        '''
+        for event in events:
+            args = tx.get_event_args(
+                self.address, event, self.param_names.get(event.name))
+
+            if args is not None and args.get(field) is not None:
+                value = args[field]
+
+                return "0x" + value.hex() if isinstance(value, bytes) else hex(value)
+
+        return None
+
+    def get_dest_row(self, tx: Transaction) -> Dict[str, object] | None:
+        '''
+            Determines the token transfer of a destination transaction from its token_transfer()
+            function, along with the source transfer id of the relay, if any
+
+            @returns a row with the DEST_COLUMNS keys and destBlock, or None without a token transfer
+        '''
+        data = tx.get_token_transfer()
+
+        if len(data) < 4:
+            return None
+
+        _from, _to, token_addr, amount = data
+
+        return {'destHash': tx.hash, 'destSender': _from, 'destReceiver': _to, 'destTokenAddr': token_addr,
+                'destChainId': int(self.chain), 'destValue': int(amount, 16),
+                'transferId': self.get_transfer_id(tx, self.dest_events, DestEvents.SRCTRANSFERID.value),
+                'destBlock': tx.block}
+
+    def get_dest_rows(self) -> List[Dict[str, object]]:
+        '''
+            Returns the get_dest_row of every loaded destination transaction with a token transfer
+        '''
+        return self.get_dest_rows_from(0)
+
+    def get_dest_rows_from(self, start: int) -> List[Dict[str, object]]:
+        '''
+            Returns the get_dest_row of the destination transactions loaded from position start on
+        '''
+        rows = [self.get_dest_row(tx) for tx in self.dest_tx[start:]]
+
+        return [i for i in rows if i is not None]
+
     def get_dest_token_transfers(self) -> pd.DataFrame:
         '''
             Determines token transfers on the destination chain from the token_transfer() function of
             the transaction. This methos is *safer*, since transfer logs rely less on events. 
 
             @returns a dataframe consisting of the collected information:
-                | destHash | destSender | destReceiver | destTokenAddr | destChainId | destValue
+                | destHash | destSender | destReceiver | destTokenAddr | destChainId | destValue | transferId
 
         '''
-        temp = {}
+        return pd.DataFrame(self.get_dest_rows(), columns=DEST_COLUMNS)
 
-        for tx in self.dest_tx:
-            data = tx.get_token_transfer()
+    def get_src_row(self, tx: Transaction) -> Dict[str, object] | None:
+        '''
+            Determines token transfer information from a source transaction. We decode the outbound
+            function call of the transaction to get the destination chain id and destination receiver,
+            and the outbound event for the transfer id
 
-            if len(data) < 4:
-                continue
+            @returns a row with the SRC_COLUMNS keys and srcBlock, or None if the transaction is not a send
+        '''
+        data = tx.get_token_transfer()
+
+        if len(data) < 4:
+            return None
 
-            _from, _to, token_addr, amount = data
+        _from, _to, token_addr, amount = data
 
-            temp[tx.hash] = [tx.hash, _from, _to,
-                             token_addr, int(self.chain), int(amount, 16)]
+        args = self.get_src_args(tx)
 
-        return pd.DataFrame.from_dict(temp, orient='index', columns=['destHash', 'destSender', 'destReceiver', 'destTokenAddr', 'destChainId', 'destValue'])
+        if args is None or not {'dstChainId', 'receiver'} <= args.keys():
+            return None
 
-    def get_src_token_transfers(self) -> pd.DataFrame:
+        return {'srcHash': tx.hash, 'srcSender': _from, 'srcReceiver': _to, 'srcTokenAddr': token_addr,
+                'srcChainId': int(self.chain), 'srcValue': int(amount, 16), 'destChainId': args['dstChainId'],
+                'destReceiver': args['receiver'],
+                'transferId': self.get_transfer_id(tx, self.src_events, SrcEvents.TRANSFERID.value),
+                'srcBlock': tx.block}
+
+    def get_src_rows(self) -> List[Dict[str, object]]:
+        '''
+            Returns the get_src_row of the loaded src_tx, if it is a send
         '''
-            Determines token transfer information from the src_tx object. We collect information from the 
-            initial transaction function call to get the destination chain id and destination receiver.
+        if self.src_tx is None:
+            return []
 
-            @returns a pandas dataframe consisting of the following columns
-                | srcHash | srcSender | srcReceiver | srcTokenAddr | srcChainId | srcValue | destChainId | destReceiver
+        row = self.get_src_row(self.src_tx)
+
+        return [row] if row is not None else []
+
+    def __extract(self, start_block: int, end_block: int, funcs: List[Function], batch_size: int) -> Iterator[Transaction]:
+        """
+            Yields every token transfer transaction calling one of funcs on the endpoint within a
+            block range, read through a single query
+        """
+        docs = self.db.get_block_range(start_block, end_block, self.address, 0, projection={"_id": 0},
+                                       batch_size=batch_size, selectors=[func.signature for func in funcs])
+
+        for doc in docs:
+            tx = Transaction(doc['tx'], self.db, self.store, data=doc)
+
+            if tx.is_token_transfer and any(tx.contains_function(self.address, func.signature) for func in funcs):
+                yield tx
+
+    def extract_sends(self, start_block: int, end_block: int, batch_size: int = 100) -> List[Dict[str, object]]:
         '''
-        temp = {}
+            Extracts every send of the endpoint within a block range in one scan, for bulk linking
 
-        if self.src_tx is None:
-            return pd.DataFrame(columns=['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId', 'destReceiver'])
+            @param start_block : the first block to scan
+            @param end_block : the last block to scan
+            @param batch_size : the number of transactions fetched per mongodb round trip (default 100)
 
-        data = self.src_tx.get_token_transfer()
+            @returns the get_src_row of each send, with its srcTimestamp, ordered by time
+        '''
+        rows = []
 
-        if len(data) < 4:
-            return pd.DataFrame(columns=['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId', 'destReceiver'])
+        for tx in self.__extract(start_block, end_block, self.src_funcs, batch_size):
+            row = self.get_src_row(tx)
 
-        _from, _to, token_addr, amount = data
+            if row is not None:
+                row['srcTimestamp'] = self.store.get_block_timestamp(tx.block)
+                rows.append(row)
 
-        dest_chain_id = self.src_tx.get_function_value(3)
+        return sorted((i for i in rows if i['srcTimestamp'] is not None), key=lambda i: i['srcTimestamp'])
 
-        dest_receiver = hex(self.src_tx.get_function_value(0))
+    def extract_relays(self, start_block: int, end_block: int, batch_size: int = 100) -> List[Dict[str, object]]:
+        '''
+            Extracts every relay of the endpoint within a block range in one scan, for bulk linking
 
-        temp[self.src_tx.hash] = [self.src_tx.hash, _from,
-                                  _to, token_addr, int(self.chain), int(amount, 16), dest_chain_id, dest_receiver]
+            @param start_block : the first block to scan
+            @param end_block : the last block to scan
+            @param batch_size : the number of transactions fetched per mongodb round trip (default 100)
 
-        return pd.DataFrame.from_dict(temp, orient='index', columns=['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId', 'destReceiver'])
+            @returns the get_dest_row of each relay, with its destTimestamp, ordered by time
+        '''
+        rows = []
+
+        for tx in self.__extract(start_block, end_block, self.dest_funcs, batch_size):
+            row = self.get_dest_row(tx)
+
+            if row is not None:
+                row['destTimestamp'] = self.store.get_block_timestamp(tx.block)
+                rows.append(row)
+
+        return sorted((i for i in rows if i['destTimestamp'] is not None), key=lambda i: i['destTimestamp'])
+
+    def get_src_token_transfers(self) -> pd.DataFrame:
+        '''
+            Determines token transfer information from the src_tx object, see get_src_rows
+
+            @returns a pandas dataframe consisting of the following columns
+                | srcHash | srcSender | srcReceiver | srcTokenAddr | srcChainId | srcValue | destChainId | destReceiver | transferId
+        '''
+        return pd.DataFrame(self.get_src_rows(), columns=SRC_COLUMNS)
 
 
 class Bridge():
@@ -245,20 +472,39 @@ class Bridge():
         implementation
     '''
 
-    def __init__(self, name: str, data: Dict[str, str], stores: Dict[str, ContractStore], dbs: Dict[str, MongoFetcher], chains: List[str]) -> None:
+    def __init__(self, name: str, data: Dict[str, str], stores: Dict[str, ContractStore], dbs: Dict[str, MongoFetcher], chains: List[str],
+                 relative_blocks: Dict[Tuple[int, Chains, Chains], int] = None, linker: IncrementalLinker = None,
+                 window_cache: WindowCache = None, latency: LatencyProfile = None) -> None:
         self.name = name
         self.stores = stores
         self.dbs = dbs
 
+        self.relative_blocks = relative_blocks if relative_blocks is not None else {}
+
+        # when set, transfers are linked incrementally across loaded transactions
+        self.linker = linker
+
+        self.window_cache = window_cache
+
+        # the relay delays of confirmed links, sizing the destination windows of each route
+        self.latency = latency if latency is not None else LatencyProfile()
+
         self.bridges: Dict[str, Endpoint] = self.__load_endpoints(data, chains)
 
         self.current_transaction = None
 
-        self.linked_tx: pd.DataFrame = pd.DataFrame(columns=[
-            'srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destHash', 'destSender', 'destReceiver', 'destTokenAddr', 'destChainId', 'destValue'])
+        self.linked_tx: pd.DataFrame = pd.DataFrame(
+            columns=[*LINKED_COLUMNS, *BLOCK_COLUMNS])
 
+        # linked rows that were dropped, with the reason why (amount, expired)
         self.invalid_tx: pd.DataFrame = pd.DataFrame(
-            columns=['type'', hash', 'sender', 'receiver', 'tokenAddr', 'chainId', 'value', 'reason'])
+            columns=[*LINKED_COLUMNS, 'reason'])
+
+        # sends and relays whose block timestamp could not be found yet, retried by link_incremental
+        self.untimed: List[Tuple[Endpoint, str, Dict[str, object], int]] = []
+
+        # sends that will never be linked, kept across transactions until popped by the caller
+        self.expired_tx: List[Dict[str, object]] = []
 
     def __load_endpoints(self, data: Dict[str, str], chains: List[Chains]) -> None:
         ''' 
@@ -286,34 +532,102 @@ class Bridge():
 
             if chain in chains:
                 endpoint = Endpoint(chain, address, self.dbs[c], self.stores[c],
-                                    dest_funcs, src_funcs, dest_events, src_events)
+                                    dest_funcs, src_funcs, dest_events, src_events, self.window_cache)
 
                 res[chain] = endpoint
 
         return res
 
-    def load_transaction(self, src_chain: Chains, tx: str, _range=100, amount=100):
+    def load_transaction(self, src_chain: Chains, tx: str, _range: int = None, amount: int = 100, data: dict = None):
         """
             Loads in a transaction on the source chain, then determines the relative 
             range of transactions on the destination chain, and loads all possible
             transactions over that range.
 
+            By default the range is learned per route: the windows of self.latency are searched
+            one after the other, each only when no relay of the send was found in the previous
+            one. The profile itself is only fed validated links, see record_latencies
+
             @param src_chain : the chain to search for the initial transaction on
             @param tx : the transaction hash to look for on the original chain
-            @param _range : the number of blocks we should permit the destination transaction
-            to occur maximum after (default 100)
+            @param _range : a fixed number of blocks we should permit the destination transaction
+            to occur maximum after (default None, the learned windows of the route)
             @param amount : the max amount of transactions to search for on the destination
-            chain (default 100)
+            chain, over every window (default 100)
+            @param data : the already fetched document of the source transaction, if any
         """
 
-        self.bridges[src_chain].load_src_transaction(tx)
+        if src_chain not in self.bridges:
+            return
+
+        src = self.bridges[src_chain]
+
+        src.load_src_transaction(tx, data)
+
+        if src.src_tx is None:
+            return
+
+        dest_chain = src.get_src_transaction_chain()
+
+        if dest_chain not in self.bridges:
+            return
+
+        dest = self.bridges[dest_chain]
 
-        dest_chain = self.bridges[src_chain].get_src_transaction_chain()
         relative_block = self.get_relative_chain_block(
-            self.bridges[src_chain].src_tx.block, src_chain, dest_chain)
+            src.src_tx.block, src_chain, dest_chain)
+
+        src_row = src.get_src_row(src.src_tx)
+
+        if _range is not None:
+            windows = [_range]
+        else:
+            windows = self.latency.get_windows(self.name, src_chain, dest_chain)
+
+        if relative_block is None:
+            return
+
+        start_block = relative_block
+        first = len(dest.dest_tx)
+
+        for window in windows:
+            loaded = len(dest.dest_tx)
+
+            if loaded - first >= amount:
+                return
+
+            # a wider window only loads the blocks past the previous one
+            dest.load_dest_transactions(
+                start_block, relative_block + window, amount - (loaded - first))
+
+            start_block = relative_block + window + 1
 
-        self.bridges[dest_chain].load_dest_transactions(
-            relative_block, relative_block + _range, amount)
+            if src_row is None or self.__find_relay(src_row, dest.get_dest_rows_from(loaded)) is not None:
+                return
+
+    def __find_relay(self, src_row: Dict[str, object], dest_rows: List[Dict[str, object]]) -> Dict[str, object] | None:
+        """
+            Returns the first destination row the send of src_row is linked to, by transfer id
+            if the send has one, else by destination chain and receiver, as in link_token_transfers
+        """
+        for row in dest_rows:
+            if src_row['transferId'] is not None:
+                if row['transferId'] == src_row['transferId']:
+                    return row
+            elif row['destChainId'] == src_row['destChainId'] and row['destReceiver'] == src_row['destReceiver']:
+                return row
+
+        return None
+
+    def reset(self) -> None:
+        '''
+            Clears the transactions loaded on every endpoint of the bridge, and the invalid
+            transactions found for them
+        '''
+        for endpoint in self.bridges.values():
+            endpoint.reset()
+
+        self.invalid_tx = pd.DataFrame(columns=[*LINKED_COLUMNS, 'reason'])
 
     def link_transactions(self) -> None:
         '''
@@ -324,45 +638,206 @@ class Bridge():
 
         self.find_invalid_transfer_amt()
 
+        self.record_latencies()
+
     def link_token_transfers(self) -> None:
         '''
-            Collects all source and destination token transfer information 
-            from each endpoint, joining the two dataframes on the destChainId
-            column and the destReceiver column. If those two columns do not match,
-            it is impossible to draw any link 
+            Collects all source and destination token transfer information from each endpoint.
+            Transfers carrying a transfer id (the transferId of the Send and the srcTransferID
+            of the Relay) are linked on it with a hash join. Only the source transfers without
+            an id fall back to joining on the destChainId column and the destReceiver column.
+            If those two columns do not match, it is impossible to draw any link, and sends
+            and relays left unlinked are dropped
 
             TODO: is it safe to not draw any link if receiver is different? What 
             if that is a vulnerability?
         '''
-        dest_txs = pd.DataFrame(columns=[
-                                'destHash', 'destSender', 'destReceiver', 'destTokenAddr', 'destChainId', 'destValue'])
-        src_txs = pd.DataFrame(
-            columns=['srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId', 'destReceiver'])
+        if self.linker is not None:
+            self.expired_tx.extend(self.link_incremental())
+            return
+
+        src_rows = []
+        dest_rows = []
 
         for i in self.bridges.values():
-            src_txs = pd.concat(
-                [src_txs, i.get_src_token_transfers()], ignore_index=True)
+            src_rows.extend(i.get_src_rows())
+            dest_rows.extend(i.get_dest_rows())
+
+        linked, src_rest, dest_rest = link_by_transfer_id(src_rows, dest_rows)
+
+        # amounts are uint256, so the frames are kept as object to never cast them to float
+        linked_tx = [pd.DataFrame([i for i in linked if 'destHash' in i],
+                                  columns=[*LINKED_COLUMNS, *BLOCK_COLUMNS], dtype=object)]
+
+        if len(src_rest) > 0 and len(dest_rest) > 0:
+            src_txs = pd.DataFrame(
+                src_rest, columns=[*SRC_COLUMNS, 'srcBlock'], dtype=object)
+            dest_txs = pd.DataFrame(dest_rest, columns=[*DEST_COLUMNS, 'destBlock'], dtype=object).drop(
+                columns=['transferId'])
+
+            linked_tx.append(src_txs.merge(
+                dest_txs, on=['destReceiver', 'destChainId'], how='inner'))
+
+        self.linked_tx = pd.concat(
+            linked_tx, ignore_index=True)[[*LINKED_COLUMNS, *BLOCK_COLUMNS]]
+
+    def link_incremental(self) -> List[Dict[str, object]]:
+        '''
+            Adds the loaded sends, then the loaded relays, of every endpoint to the incremental
+            linker, setting .linked_tx to the transfers linked by them. Sends and relays without
+            a counterpart yet are kept by the linker, so they can still be linked by a later
+            transaction, until the block-time watermark expires them
+
+            A send or relay whose block timestamp is not found is kept back and retried on the
+            next calls, as entering it at time 0 would have it expired right away. After
+            UNTIMED_ATTEMPTS attempts it is given up on
+
+            @returns the sends of the bridge that will never be linked: the sends expired by the
+            linker and the sends whose timestamp was given up on
+        '''
+        rows = self.untimed
+        self.untimed = []
+
+        for endpoint in self.bridges.values():
+            rows.extend((endpoint, "send", row, 0)
+                        for row in endpoint.get_src_rows())
+
+        for endpoint in self.bridges.values():
+            rows.extend((endpoint, "relay", row, 0)
+                        for row in endpoint.get_dest_rows())
+
+        linked = []
+        unlinked = []
+
+        for endpoint, side, row, attempts in rows:
+            # cached destination windows overlap, so most relays were already added
+            if self.linker.has_seen(self.name, row['srcHash'] if side == "send" else row['destHash']):
+                continue
+
+            if side == "send":
+                timestamp = endpoint.store.get_block_timestamp(row['srcBlock'])
+            else:
+                timestamp = endpoint.store.get_block_timestamp(row['destBlock'])
+
+            if timestamp is None:
+                if attempts + 1 < UNTIMED_ATTEMPTS:
+                    self.untimed.append((endpoint, side, row, attempts + 1))
+                elif side == "send":
+                    unlinked.append(row)
+
+                continue
+
+            if side == "send":
+                match = self.linker.add_send(row, timestamp, self.name)
+            else:
+                match = self.linker.add_relay(row, timestamp, self.name)
+
+            if match is not None:
+                linked.append(match)
+
+        self.linked_tx = pd.DataFrame(
+            linked, columns=[*LINKED_COLUMNS, *BLOCK_COLUMNS], dtype=object)
 
-            dest_txs = pd.concat(
-                [dest_txs, i.get_dest_token_transfers()], ignore_index=True)
+        return unlinked + self.linker.expire(self.name)
 
-        self.linked_tx = src_txs.merge(
-            dest_txs, on=['destReceiver', 'destChainId'], how='outer')
+    def bulk_link(self, src_chain: Chains, start_block: int, end_block: int, tolerance: int = 3600) -> pd.DataFrame:
+        '''
+            Links every send of the source chain endpoint within a block range in bulk. All sends,
+            and all relays of the other endpoints over the aligned time range (extended by the
+            tolerance), are extracted with one scan per endpoint into time ordered tables, which
+            are then linked with a single as-of join, see linker.link_asof
+
+            @param src_chain : the chain of the sends
+            @param start_block : the first block of the source chain to link
+            @param end_block : the last block of the source chain to link
+            @param tolerance : the maximum delay in seconds between a send and its relay (default 3600)
+
+            @returns the linked transactions, which are also set as .linked_tx
+        '''
+        if src_chain not in self.bridges:
+            return self.linked_tx
+
+        src = self.bridges[src_chain]
+
+        sends = src.extract_sends(start_block, end_block)
+
+        start_timestamp = src.store.get_block_timestamp(start_block)
+        end_timestamp = src.store.get_block_timestamp(end_block)
+
+        relays = []
+
+        if start_timestamp is None or end_timestamp is None:
+            return self.linked_tx
+
+        for chain, endpoint in self.bridges.items():
+            if chain == src_chain:
+                continue
+
+            dest_start = endpoint.store.get_closest_block(start_timestamp)
+            dest_end = endpoint.store.get_closest_block(
+                end_timestamp + tolerance) or endpoint.store.get_closest_block(end_timestamp)
+
+            if dest_start is None or dest_end is None:
+                continue
+
+            relays.extend(endpoint.extract_relays(dest_start, dest_end))
+
+        self.linked_tx = pd.DataFrame(link_asof(
+            sends, relays, tolerance), columns=[*LINKED_COLUMNS, *BLOCK_COLUMNS], dtype=object)
+
+        self.find_invalid_transfer_amt()
+
+        self.record_latencies()
+
+        return self.linked_tx
 
     def find_invalid_transfer_amt(self) -> None:
         '''
             Reduces self.linked_tx to the set of linked transactions where the received
             token amount on the destination chain is less than or equal to on the source
             chain. Any transactions that have a destination chain transfer amount greater
-            than the source chain is added to the invalid_tx dataframe 
+            than the source chain is added to the invalid_tx dataframe. Unlinked sends and
+            relays, missing one of the amounts, are dropped. Amounts are uint256, so they are
+            compared as Python ints and never cast to float
+        '''
+        linked_tx = self.linked_tx[self.linked_tx['srcValue'].notna()
+                                   & self.linked_tx['destValue'].notna()]
+
+        invalid_mask = pd.Series([int(dest) > int(src) for src, dest in zip(linked_tx['srcValue'], linked_tx['destValue'])],
+                                 index=linked_tx.index, dtype=bool)
+
+        invalid = linked_tx[invalid_mask]
+
+        self.linked_tx = linked_tx[~invalid_mask]
+
+        self.invalid_tx = pd.concat([self.invalid_tx, invalid.assign(reason="amount")],
+                                    ignore_index=True)
+
+    def record_latencies(self) -> None:
         '''
-        self.linked_tx = self.linked_tx[self.linked_tx['destValue']
-                                        <= self.linked_tx['srcValue']]
+            Records the relay delay of every link left in self.linked_tx by find_invalid_transfer_amt
+            into the latency profile, the number of destination blocks between the block aligned
+            to the send and the block of its relay. Every linking path calls this once its links
+            are validated, so the learned windows are only sized from valid links
+        '''
+        for row in self.linked_tx[BLOCK_COLUMNS + ['srcChainId', 'destChainId']].to_dict('records'):
+            if pd.isna(row['srcBlock']) or pd.isna(row['destBlock']):
+                continue
 
-        self.invalid_tx = self.linked_tx[self.linked_tx['destValue']
-                                         > self.linked_tx['srcValue']]
+            try:
+                src_chain = Chains(int(row['srcChainId']))
+                dest_chain = Chains(int(row['destChainId']))
 
-    def get_relative_chain_block(self, block: int, src_chain: Chains, dest_chain: Chains) -> int:
+                relative_block = self.get_relative_chain_block(
+                    int(row['srcBlock']), src_chain, dest_chain)
+            except ValueError:
+                continue
+
+            if relative_block is not None:
+                self.latency.record(self.name, src_chain, dest_chain,
+                                    int(row['destBlock']) - relative_block)
+
+    def get_relative_chain_block(self, block: int, src_chain: Chains, dest_chain: Chains) -> int | None:
         '''
             Determines the block number that was most closely minted on a different chain
             relative to a block number on the source chain.
@@ -372,15 +847,29 @@ class Bridge():
             @param dest_chain : the chain to get the relative block number for 
 
             @returns an int consisting of the closest block that was created on dest_chain
-            relative to block on the src_chain 
+            relative to block on the src_chain, or None if either block is not known (which
+            is not memoized, so it is looked up again later)
         '''
         if src_chain not in self.bridges or dest_chain not in self.bridges:
             raise ValueError
 
-        timestamp = self.stores[Chains.to_str(
-            src_chain)].get_block_timestamp(block)
+        key = (block, src_chain, dest_chain)
+
+        if key not in self.relative_blocks:
+            # the stores are taken from the endpoints, which are keyed by Chains like the arguments
+            timestamp = self.bridges[src_chain].store.get_block_timestamp(block)
 
-        return self.stores[Chains.to_str(dest_chain)].get_closest_block(timestamp)
+            if timestamp is None:
+                return None
+
+            relative_block = self.bridges[dest_chain].store.get_closest_block(timestamp)
+
+            if relative_block is None:
+                return None
+
+            self.relative_blocks[key] = relative_block
+
+        return self.relative_blocks[key]
 
     def __str__(self) -> str:
         return f"{self.name} at {self.address} \n Inputs: \n {self.dest_funcs} \n Outputs: \n {self.src_funcs}"
@@ -389,7 +878,8 @@ class Bridge():
         return f"{self.name} at {self.address}"
 
 class Bridges():
-    def __init__(self, eth_store: ContractStore, bsc_store: ContractStore, polygon_store: ContractStore, filename: str, bsc_fetcher: MongoFetcher, eth_fetcher: MongoFetcher, polygon_fetcher: MongoFetcher, chains: List[str]) -> None:
+    def __init__(self, eth_store: ContractStore, bsc_store: ContractStore, polygon_store: ContractStore, filename: str, bsc_fetcher: MongoFetcher, eth_fetcher: MongoFetcher, polygon_fetcher: MongoFetcher, chains: List[str],
+                 linker: IncrementalLinker = None, window_cache: WindowCache = None, latency: LatencyProfile = None) -> None:
         self.eth_store = eth_store
         self.eth_fetcher = eth_fetcher
 
@@ -401,6 +891,18 @@ class Bridges():
 
         self.bridges: List[Bridge] = []
 
+        # relative block lookups memoized by (block, src chain, dest chain), shared by every bridge
+        self.relative_blocks: Dict[Tuple[int, Chains, Chains], int] = {}
+
+        # optional incremental linker shared by every bridge, see Bridge.link_incremental
+        self.linker = linker
+
+        # optional cache of scanned destination windows, shared by every endpoint
+        self.window_cache = window_cache
+
+        # relay delays learned per route, shared by every bridge
+        self.latency = latency if latency is not None else LatencyProfile()
+
         self.__load_bridges(filename, chains)
 
         self.celer_bridge = None
@@ -425,24 +927,139 @@ class Bridges():
 
             for bridge in data:
                 self.bridges.append(
-                    Bridge(bridge, data[bridge], stores, dbs, formatted_chains))
+                    Bridge(bridge, data[bridge], stores, dbs, formatted_chains, self.relative_blocks, self.linker, self.window_cache,
+                           self.latency))
 
-    def load_transaction(self, tx: str) -> None:
+    def load_transaction(self, tx: str, src_chain: Chains = None, data: dict = None) -> None:
         ''' 
             Loads in a transaction on a bridge based on the transaction hash. 
             Within bridge.load_transaction, both the source transaction and the potential
             corresponding destination transactions are loaded, but not linked yet.
 
             @param tx : the transaction has to search for on the source chain
+            @param src_chain : the chain the transaction is on, determined via get_tx_chain if not passed
+            @param data : the already fetched document of the transaction, if any
         '''
 
+        if src_chain is None:
+            src_chain = self.get_tx_chain(tx)
+
+        if src_chain is None:
+            return
+
         for bridge in self.bridges:
-            if self.eth_store.get_tx_exists(tx):
-                bridge.load_transaction(Chains.ETH, tx)
-            elif self.bsc_store.get_tx_exists(tx):
-                bridge.load_transaction(Chains.BSC, tx)
-            elif self.polygon_store.get_tx_exists(tx):
-                bridge.load_transaction(Chains.POLYGON, tx)
+            bridge.load_transaction(src_chain, tx, data=data)
+
+    def get_tx_chain(self, tx: str) -> Chains | None:
+        '''
+            Determines the chain that a transaction hash originated from. The MongoDB collections
+            of every loaded chain are checked first, then every chain is checked concurrently
+            through the *Scan APIs
+
+            @param tx : the transaction hash to search for
+
+            @returns the Chains value the transaction exists on, or None if not found
+        '''
+        stores = {Chains.ETH: self.eth_store, Chains.BSC: self.bsc_store,
+                  Chains.POLYGON: self.polygon_store}
+        fetchers = {Chains.ETH: self.eth_fetcher, Chains.BSC: self.bsc_fetcher,
+                    Chains.POLYGON: self.polygon_fetcher}
+
+        for chain, store in stores.items():
+            if store is not None and fetchers[chain].has_tx(tx):
+                return chain
+
+        futures = {chain: store.scanner.submit(store.get_tx_exists, tx, priority=Priority.CRITICAL)
+                   for chain, store in stores.items() if store is not None}
+
+        for chain, future in futures.items():
+            if stores[chain].scanner.wait(future):
+                return chain
+
+        return None
+
+    def link_many(self, hashes: Iterable[str], src_chain: Chains = None) -> pd.DataFrame:
+        '''
+            Loads and links a batch of transactions, reusing the stores, fetchers and endpoints
+            (and so every cache) across the whole batch. Transactions that are not found
+            are skipped
+
+            @param hashes : the transaction hashes to link
+            @param src_chain : the chain every transaction is on, determined per transaction if not passed
+
+            @returns a dataframe of the linked transactions of the whole batch, in the
+            format of output_transaction
+        '''
+        linked_tx = []
+
+        for tx in hashes:
+            linked_tx.extend(self.__link(tx, src_chain))
+
+        return self.get_linked_transactions(linked_tx)
+
+    def stream_block_range(self, chain: str, start: int, end: int) -> Iterator[Dict[str, str]]:
+        '''
+            Walks the blocks of a source chain in order, linking every transaction that calls an
+            outbound function of one of the bridge endpoints on that chain. The calls are matched
+            within mongodb over batches of blocks, and each matching document is fetched once and
+            passed on to the bridges. Linked rows are yielded as they are found, so arbitrarily
+            long block ranges can be surveyed
+
+            @param chain : the name of the source chain to walk (eth, bsc, poly)
+            @param start : the first block to walk
+            @param end : the last block to walk (inclusive)
+
+            @returns a generator of linked rows, as dicts in the format of output_transaction
+        '''
+        src_chain = Chains.resolve_name(chain)
+        fetcher = {Chains.ETH: self.eth_fetcher, Chains.BSC: self.bsc_fetcher,
+                   Chains.POLYGON: self.polygon_fetcher}[src_chain]
+
+        endpoints = [bridge.bridges[src_chain]
+                     for bridge in self.bridges if src_chain in bridge.bridges]
+
+        if len(endpoints) == 0:
+            return
+
+        query = get_calls_query(
+            [endpoint.src_pattern for endpoint in endpoints])
+
+        for doc in fetcher.iter_blocks(start, end, {"_id": 0}, query):
+            for linked_tx in self.__link(doc['tx'], src_chain, doc):
+                yield from linked_tx.to_dict('records')
+
+    def bulk_link(self, chain: str, start: int, end: int, tolerance: int = 3600) -> pd.DataFrame:
+        '''
+            Links every send of every bridge on a source chain within a block range in bulk,
+            for offline backfills, see Bridge.bulk_link
+
+            @param chain : the name of the source chain (eth, bsc, poly)
+            @param start : the first block of the source chain to link
+            @param end : the last block of the source chain to link (inclusive)
+            @param tolerance : the maximum delay in seconds between a send and its relay (default 3600)
+
+            @returns a dataframe of the linked transactions, in the format of output_transaction
+        '''
+        src_chain = Chains.resolve_name(chain)
+
+        return self.get_linked_transactions([bridge.bulk_link(src_chain, start, end, tolerance) for bridge in self.bridges])
+
+    def __link(self, tx: str, src_chain: Chains = None, data: dict = None) -> List[pd.DataFrame]:
+        '''
+            Loads and links a single transaction after clearing the previous one,
+            returning the .linked_tx of every bridge
+        '''
+        for bridge in self.bridges:
+            bridge.reset()
+
+        try:
+            self.load_transaction(tx, src_chain, data)
+        except MongoTxNotFound:
+            return []
+
+        self.link_transaction()
+
+        return [bridge.linked_tx for bridge in self.bridges]
 
     def link_transaction(self) -> None:
         '''
@@ -452,21 +1069,48 @@ class Bridges():
         for bridge in self.bridges:
             bridge.link_transactions()
 
-    def output_transaction(self, filename: str = "") -> None:
+    def pop_expired_transactions(self) -> pd.DataFrame:
+        '''
+            Returns the sends of every bridge that the incremental linker gave up on (expired
+            or without a block timestamp) since the last call, clearing them
+
+            @returns a dataframe of the sends, with the SRC_COLUMNS columns
+        '''
+        expired = []
+
+        for bridge in self.bridges:
+            expired.extend(bridge.expired_tx)
+            bridge.expired_tx = []
+
+        return pd.DataFrame(expired, columns=SRC_COLUMNS, dtype=object)
+
+    def get_linked_transactions(self, linked_tx: List[pd.DataFrame] = None) -> pd.DataFrame:
+        '''
+            Combines linked transaction dataframes into a single dataframe, by default
+            the current .linked_tx of every bridge
+
+            @param linked_tx : the dataframes to combine
+        '''
+        res = pd.DataFrame(columns=LINKED_COLUMNS)
+
+        if linked_tx is None:
+            linked_tx = [i.linked_tx for i in self.bridges]
+
+        return pd.concat([res, *linked_tx], ignore_index=True, axis=0)[LINKED_COLUMNS]
+
+    def output_transaction(self, filename: str = "", res: pd.DataFrame = None) -> None:
         '''
             Outputs the current state of all bridges .linked_tx 
             variables as a pandas dataframe. If filename is defined, 
             then the output is written to the filename, else stdout
 
             @param filename : the file name (and path) to write the output to as a csv
+            @param res : the linked transactions to output, such as the result of link_many (default
+            the current .linked_tx of every bridge)
         '''
 
-        res = pd.DataFrame(columns=[
-            'srcHash', 'srcSender', 'srcReceiver', 'srcTokenAddr', 'srcChainId', 'srcValue', 'destChainId', 'destReceiver', 'destHash', 'destSender',  'destTokenAddr', 'destValue'])
-
-        linked_tx = [i.linked_tx for i in self.bridges]
-
-        res = pd.concat([res, *linked_tx], ignore_index=True, axis=0)
+        if res is None:
+            res = self.get_linked_transactions()
 
         if filename != "":
             res.to_csv(path_or_buf=filename)
@@ -3,42 +3,47 @@
     collected from the contract source code.
 """
 
+import hashlib
 import json
-from Crypto.Hash import keccak
+import threading
+import weakref
 from errors import FunctionNotFound, EventNotFound, ParamNotFound
-from typing import List
+from typing import Callable, Dict, List, Tuple
 import ethtypes
-
-erc20_sigs = [
-    "dd62ed3e90e97b3d417db9c0c7522647811bafca5afc6694f143588d255fdfb4"
-    "095ea7b334ae44009aa867bfb386f5c3b4b443ac6f0ee573fa91c4608fbadfba",
-    "23b872dd7302113369cda2901243429419bec145408fa8b352b3dd92b66c680b",
-    "a9059cbb2ab09eb219583f4a59a5d0623ade346d962bcd4e46b11da047c9049b",
-    "70a08231b98ef4ca268c9cc3f6b4590e4bfec28280db06bb5d45e689f2a360be"
-]
-
-erc20_events = [
+from signatures import registry, get_canonical_signature
+from abidecoder import decode_args, decode_event, name_values
+
+# 4-byte selectors of the functions required by each standard
+erc20_sigs = frozenset([
+    "dd62ed3e",  # allowance(address,address)
+    "095ea7b3",  # approve(address,uint256)
+    "23b872dd",  # transferFrom(address,address,uint256)
+    "a9059cbb",  # transfer(address,uint256)
+    "70a08231",  # balanceOf(address)
+])
+
+erc20_events = frozenset([
     "8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925",
     "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
-]
-
-erc721_sigs = [
-    "70a08231b98ef4ca268c9cc3f6b4590e4bfec28280db06bb5d45e689f2a360be",
-    "6352211e6566aa027e75ac9dbf2423197fbd9b82b9d981a3ab367d355866aa1c",
-    "b88d4fde60196325a28bb7f99a2582e0b46de55b18761e960c14ad7a32099465",
-    "42842e0eb38857a7775b4e7364b2775df7325074d088e7fb39590cd6281184ed",
-    "23b872dd7302113369cda2901243429419bec145408fa8b352b3dd92b66c680b",
-    "095ea7b334ae44009aa867bfb386f5c3b4b443ac6f0ee573fa91c4608fbadfba",
-    "a22cb4651ab9570f89bb516380c40ce76762284fb1f21337ceaf6adab99e7d4a",
-    "081812fc55e34fdc7cf5d8b5cf4e3621fa6423fde952ec6ab24afdc0d85c0b2e",
-    "e985e9c5c6636c6879256001057b28ccac7718ef0ac56553ff9b926452cab8a3",
-]
-
-erc721_events = [
+])
+
+erc721_sigs = frozenset([
+    "70a08231",  # balanceOf(address)
+    "6352211e",  # ownerOf(uint256)
+    "b88d4fde",  # safeTransferFrom(address,address,uint256,bytes)
+    "42842e0e",  # safeTransferFrom(address,address,uint256)
+    "23b872dd",  # transferFrom(address,address,uint256)
+    "095ea7b3",  # approve(address,uint256)
+    "a22cb465",  # setApprovalForAll(address,bool)
+    "081812fc",  # getApproved(uint256)
+    "e985e9c5",  # isApprovedForAll(address,address)
+])
+
+erc721_events = frozenset([
     "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
     "8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925",
     "17307eab39ab6107e8899845ad3d59bd9653f200f220920489ca2b5937696c31"
-]
+])
 
 
 class Event():
@@ -50,7 +55,6 @@ class Event():
         self.name = name
         self.args = args
 
-        self.k = keccak.new(digest_bits=256)
         self.signature = self.__create_signature()
 
     def __str__(self) -> str:
@@ -84,16 +88,20 @@ class Event():
     def __create_signature(self) -> str:
         """
             Creates the function signature of this via concatenating the name of the event
-            with the inputs, and then keccak256 hashing
+            with the inputs, and then keccak256 hashing through the shared signature registry
         """
 
-        input_types = ",".join([i['type'] for i in self.args])
-
-        string = str.encode(f"{self.name}({input_types})")
+        return registry.get_hash(get_canonical_signature(self.name, self.args))
 
-        self.k.update(string)
+    def decode(self, topics: List[bytes], data: bytes, names: List[str] = None) -> Dict[str, object]:
+        '''
+            Decodes the arguments of a logged instance of the event into named fields
 
-        return self.k.hexdigest()
+            @param topics : the topics of the logged event, including topic0
+            @param data : the raw non-indexed data of the logged event
+            @param names : the field names to use (default the ABI parameter names), see abidecoder.name_values
+        '''
+        return name_values(self.args, decode_event(self.args, topics, data), names)
 
     def get_param_location(self, param: str) -> int:
         ''' 
@@ -129,7 +137,6 @@ class Function():
         self.constant = constant
         self.state_mutability = state_mutability
 
-        self.k = keccak.new(digest_bits=256)
         self.signature = self.__create_signature()
 
     def __format_io(self) -> str:
@@ -191,16 +198,11 @@ class Function():
 
     def __create_signature(self) -> str:
         """
-            Creates the function signature of this via keccak256.
-            Then, trims to first 4-bytes to match function signature rules
+            Creates the function signature of this via keccak256 through the shared signature
+            registry. Then, trims to first 4-bytes to match function signature rules
         """
 
-        input_types = ",".join([i['type'] for i in self.inputs])
-        string = str.encode(f"{self.name}({input_types})")
-
-        self.k.update(string)
-
-        return self.k.hexdigest()[0:8]
+        return registry.get_selector(get_canonical_signature(self.name, self.inputs))
 
     def __eq__(self, o) -> bool:
         if isinstance(o, Function):
@@ -238,31 +240,49 @@ class Function():
     def get_param_names(self) -> List[str]:
         return [i['name'] for i in self.inputs]
 
+    def decode_input(self, calldata: bytes, names: List[str] = None) -> Dict[str, object]:
+        '''
+            Decodes the arguments of a call to the function into named fields
 
-class Contract():
+            @param calldata : the raw calldata of the call, including the selector
+            @param names : the field names to use (default the ABI parameter names), see abidecoder.name_values
+        '''
+        return name_values(self.inputs, decode_args(self.inputs, calldata[4:]), names)
+
+
+class ParsedABI():
     """
-        Contract class that stores relevant informatation about a particular contract, such as 
-        events, source code, abi, name, and address
+        The parsed Function and Event objects of a raw ABI, along with their indexes and
+        ERC classification. Parsed ABIs are shared by every contract with a byte-identical
+        ABI (such as token clones and proxies) through get_parsed_abi, so they must not be
+        modified once created
+
+        Params:
+        - abi: the raw JSON ABI
     """
 
-    def __init__(self, address: str, source_code: str, abi: str, contract_name: str, constructor_args: str) -> None:
-        self.address = address
-        self.source_code = source_code
+    def __init__(self, abi: str) -> None:
         self.abi = json.loads(abi)
-        self.contract_name = contract_name
-        self.constructor_args = constructor_args
 
-        self.events = self.__load_events()
-        self.functions = self.__load_functions()
+        self.events = tuple(self.__load_events())
+        self.functions = tuple(self.__load_functions())
 
-        self.is_erc_20 = True
-        self.is_erc_721 = True
+        self.functions_by_name: Dict[str, List[Function]] = {}
+        self.functions_by_selector: Dict[str, Function] = {}
+        self.events_by_name: Dict[str, List[Event]] = {}
+        self.events_by_topic: Dict[str, Event] = {}
 
-        self.__determine_contract_type()
+        self.__index()
 
-    def __load_events(self) -> [Event]:
+        self.selectors = frozenset(self.functions_by_selector)
+        self.topics = frozenset(self.events_by_topic)
+
+        self.is_erc_20 = erc20_sigs <= self.selectors and erc20_events <= self.topics
+        self.is_erc_721 = erc721_sigs <= self.selectors and erc721_events <= self.topics
+
+    def __load_events(self) -> List[Event]:
         """
-            Loads all events from the abi of the contract into the self.events property
+            Loads all events from the abi
         """
 
         events = []
@@ -293,6 +313,131 @@ class Contract():
 
         return functions
 
+    def __index(self) -> None:
+        """
+            Indexes the functions and events by name (keeping every overload, in ABI order)
+            and by their 4-byte selector / topic hash
+        """
+
+        for f in self.functions:
+            self.functions_by_name.setdefault(f.name, []).append(f)
+            self.functions_by_selector.setdefault(f.signature, f)
+
+        for e in self.events:
+            self.events_by_name.setdefault(e.name, []).append(e)
+            self.events_by_topic.setdefault(e.signature, e)
+
+
+parsed_abis: "weakref.WeakValueDictionary[str, ParsedABI]" = weakref.WeakValueDictionary()
+parsed_abis_lock = threading.Lock()
+
+
+def get_parsed_abi(abi: str) -> ParsedABI:
+    '''
+        Returns the ParsedABI of a raw ABI, shared by every contract whose ABI has the same
+        content hash. A ParsedABI is dropped once no contract references it anymore
+    '''
+    key = hashlib.sha256(abi.encode()).hexdigest()
+
+    with parsed_abis_lock:
+        parsed = parsed_abis.get(key)
+
+    if parsed is None:
+        parsed = ParsedABI(abi)
+
+        with parsed_abis_lock:
+            parsed = parsed_abis.setdefault(key, parsed)
+
+    return parsed
+
+
+class Contract():
+    """
+        Contract class that stores relevant informatation about a particular contract, such as 
+        events, source code, abi, name, and address. The ABI is only parsed into Function and
+        Event objects on the first access to them, sharing the ParsedABI of identical ABIs, and
+        the source code can be passed as a callable so that it is only loaded (and not kept in
+        memory) on request
+
+        Params:
+        - address: the address of the contract
+        - source_code: the verified source code, or a callable returning it
+        - abi: the raw JSON ABI of the contract
+        - contract_name: the name of the contract
+        - constructor_args: the constructor arguments of the contract
+    """
+
+    def __init__(self, address: str, source_code: str | Callable[[], str], abi: str, contract_name: str, constructor_args: str) -> None:
+        self.address = address
+        self.raw_abi = abi
+        self.contract_name = contract_name
+        self.constructor_args = constructor_args
+
+        self.__source_code = source_code
+        self.__parsed: ParsedABI = None
+        self.__func_signatures: Dict[str, List[str]] = None
+
+    @property
+    def source_code(self) -> str:
+        if callable(self.__source_code):
+            return self.__source_code()
+
+        return self.__source_code
+
+    def __ensure_abi(self) -> ParsedABI:
+        """
+            Returns the shared ParsedABI of the contract, getting it on the first access
+        """
+        if self.__parsed is None:
+            self.__parsed = get_parsed_abi(self.raw_abi)
+
+        return self.__parsed
+
+    @property
+    def abi(self) -> List[dict]:
+        return self.__ensure_abi().abi
+
+    @property
+    def events(self) -> Tuple[Event]:
+        return self.__ensure_abi().events
+
+    @property
+    def functions(self) -> Tuple[Function]:
+        return self.__ensure_abi().functions
+
+    @property
+    def functions_by_name(self) -> Dict[str, List[Function]]:
+        return self.__ensure_abi().functions_by_name
+
+    @property
+    def functions_by_selector(self) -> Dict[str, Function]:
+        return self.__ensure_abi().functions_by_selector
+
+    @property
+    def events_by_name(self) -> Dict[str, List[Event]]:
+        return self.__ensure_abi().events_by_name
+
+    @property
+    def events_by_topic(self) -> Dict[str, Event]:
+        return self.__ensure_abi().events_by_topic
+
+    @property
+    def func_signatures(self) -> Dict[str, List[str]]:
+        # built once per contract, as it is read for every transaction calling the contract
+        if self.__func_signatures is None:
+            self.__func_signatures = {
+                self.address: list(self.functions_by_selector)}
+
+        return self.__func_signatures
+
+    @property
+    def is_erc_20(self) -> bool:
+        return self.__ensure_abi().is_erc_20
+
+    @property
+    def is_erc_721(self) -> bool:
+        return self.__ensure_abi().is_erc_721
+
     def __str__(self) -> str:
         return (f"Contract: {self.contract_name} at {self.address}\n"
                 f"Constructor args: {self.constructor_args}\n"
@@ -319,19 +464,41 @@ class Contract():
             Returns a list of all the function signatures for the contract
         """
 
-        return {self.address: [i.signature for i in self.functions]}
+        return self.func_signatures
 
     def get_function(self, name: str) -> Function:
         '''
-            Gets a function object belonging to a contract based on the name of the function
+            Gets a function object belonging to a contract based on the name of the function.
+            For overloaded functions, the first in the ABI is returned
 
             @param name : the name of the function to search for 
 
             @returns a function object that corresponds to that name 
         '''
-        for f in self.functions:
-            if f.name == name:
-                return f
+        if name in self.functions_by_name:
+            return self.functions_by_name[name][0]
+
+        raise FunctionNotFound
+
+    def get_functions(self, name: str) -> List[Function]:
+        '''
+            Gets every overload of a function belonging to the contract, in ABI order
+
+            @param name : the name of the function to search for
+        '''
+        if name in self.functions_by_name:
+            return self.functions_by_name[name]
+
+        raise FunctionNotFound
+
+    def get_function_by_selector(self, selector: str) -> Function:
+        '''
+            Gets a function object belonging to the contract based on its 4-byte selector
+
+            @param selector : the hex selector of the function, without 0x
+        '''
+        if selector in self.functions_by_selector:
+            return self.functions_by_selector[selector]
 
         raise FunctionNotFound
 
@@ -343,9 +510,19 @@ class Contract():
 
             @returns the Event object of the event that matches 
         '''
-        for e in self.events:
-            if e.name == name:
-                return e
+        if name in self.events_by_name:
+            return self.events_by_name[name][0]
+
+        raise EventNotFound
+
+    def get_event_by_signature(self, event_sig: str) -> Event:
+        '''
+            Gets an event object belonging to the contract based on its topic hash
+
+            @param event_sig : the hex topic hash of the event, without 0x
+        '''
+        if event_sig in self.events_by_topic:
+            return self.events_by_topic[event_sig]
 
         raise EventNotFound
 
@@ -358,49 +535,19 @@ class Contract():
             lengths for
         '''
 
-        lengths = []
-        for e in self.events:
-            if e.signature == event_sig:
-                lengths = [ethtypes.get_type_length(i['type']) for i in e.args]
+        if event_sig not in self.events_by_topic:
+            return []
 
-        return lengths
+        return [ethtypes.get_type_length(i['type']) for i in self.events_by_topic[event_sig].args]
 
     def get_event_param_location(self, event_sig: str, name: str) -> int:
         ''' 
             TODO: NOT USED RIGHT NOW
         '''
-        for e in self.events:
-            if e.name == event_sig:
-                return e.get_param_location(name)
+        if event_sig in self.events_by_name:
+            return self.events_by_name[event_sig][0].get_param_location(name)
 
         raise ParamNotFound
 
-    def __determine_contract_type(self) -> None:
-        '''
-            Determines the type of a contract based on the implemented events
-            and functions of the contract. We can determine if a contract is
-            ERC20/721 based on the events and functions, since we know the required
-            functions of an ERC20/721 contract 
-        '''
-        erc_funcs = []
-        erc_events = []
-
-        for func in self.functions:
-            if func.signature in erc20_sigs:
-                erc_funcs.append(func.signature)
-            elif func.signature in erc721_sigs:
-                erc_funcs.append(func.signature)
-
-        for event in self.events:
-            if event.signature in erc20_events:
-                erc_events.append(event.signature)
-            elif event.signature in erc721_sigs:
-                erc_funcs.append(func.signature)
-
-        if erc_funcs != erc20_sigs or erc_events != erc20_events:
-            self.is_erc_20 = False
-        elif erc_funcs != erc721_sigs or erc_events != erc721_events:
-            self.is_erc_721 = False
-
     def get_type(self) -> str:
         return "ERC20" if self.is_erc_20 else "ERC721" if self.is_erc_721 else ""
@@ -0,0 +1,140 @@
+"""
+    Defines a persistent, on-disk cache for the raw contract information pulled
+    from the *Scan APIs, so that repeated runs do not re-download the same contracts
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+CONTRACTCACHE = "./contracts.db"
+
+
+class ContractCache():
+    """
+        Sqlite backed cache of raw contract information, keyed by the chain and address
+        of the contract. Stores the source code, abi, contract name and constructor args
+        exactly as returned by *Scan, along with a marker for unverified contracts so that
+        they are not requested again until unverified_ttl seconds have passed
+
+        Params:
+        - filepath: the path of the sqlite file to use (default ./contracts.db)
+        - unverified_ttl: the number of seconds to trust a cached unverified result (default 1 day)
+    """
+
+    def __init__(self, filepath: str = CONTRACTCACHE, unverified_ttl: int = 86400) -> None:
+        self.filepath = filepath
+        self.unverified_ttl = unverified_ttl
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+
+        self.__create_tables()
+
+    def __create_tables(self) -> None:
+        """
+            Creates the contracts and signatures tables if they do not already exist
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS contracts ("
+                "chain TEXT NOT NULL, "
+                "address TEXT NOT NULL, "
+                "verified INTEGER NOT NULL, "
+                "source_code TEXT, "
+                "abi TEXT, "
+                "contract_name TEXT, "
+                "constructor_args TEXT, "
+                "fetched INTEGER NOT NULL, "
+                "PRIMARY KEY (chain, address))")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS signatures ("
+                "signature TEXT PRIMARY KEY, "
+                "hash TEXT NOT NULL)")
+
+    def get(self, chain: str, address: str, source_code: bool = True) -> Dict[str, str] | None:
+        """
+            Returns the cached raw contract information for an address on a chain.
+
+            Params:
+            - chain: the name of the chain the contract is deployed on (eth, bsc, poly)
+            - address: the address of the contract
+            - source_code: whether to read the source code, else SourceCode is None (default True)
+
+            Returns:
+            - None if the address is not cached (or the unverified marker has expired),
+              an empty dict if the contract is cached as unverified, else a dict with the
+              SourceCode, ABI, ContractName and ConstructorArguments keys as in *Scan
+        """
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT verified, {'source_code' if source_code else 'NULL'}, abi, contract_name, constructor_args, fetched "
+                "FROM contracts WHERE chain = ? AND address = ?", (chain, address.lower())).fetchone()
+
+        if row is None:
+            return None
+
+        verified, source_code, abi, contract_name, constructor_args, fetched = row
+
+        if not verified:
+            if time.time() - fetched > self.unverified_ttl:
+                return None
+
+            return {}
+
+        return {
+            "SourceCode": source_code,
+            "ABI": abi,
+            "ContractName": contract_name,
+            "ConstructorArguments": constructor_args
+        }
+
+    def put(self, chain: str, address: str, info: Dict[str, str]) -> None:
+        """
+            Stores the raw contract information for an address on a chain. An empty
+            or None info marks the contract as unverified.
+
+            Params:
+            - chain: the name of the chain the contract is deployed on
+            - address: the address of the contract
+            - info: the *Scan getsourcecode result for the contract
+        """
+        if info:
+            row = (chain, address.lower(), 1, info['SourceCode'], info['ABI'],
+                   info['ContractName'], info['ConstructorArguments'], int(time.time()))
+        else:
+            row = (chain, address.lower(), 0, None,
+                   None, None, None, int(time.time()))
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO contracts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def get_source_code(self, chain: str, address: str) -> str | None:
+        """
+            Returns the cached source code of a verified contract, or None if it is not cached
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT source_code FROM contracts WHERE chain = ? AND address = ?", (chain, address.lower())).fetchone()
+
+        return row[0] if row is not None else None
+
+    def get_signatures(self, limit: int = -1) -> List[Tuple[str, str]]:
+        """
+            Returns up to limit persisted (canonical signature, keccak256 hash) pairs
+        """
+        with self.lock:
+            return self.conn.execute("SELECT signature, hash FROM signatures LIMIT ?", (limit,)).fetchall()
+
+    def put_signatures(self, signatures: Iterable[Tuple[str, str]]) -> None:
+        """
+            Persists (canonical signature, keccak256 hash) pairs
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO signatures VALUES (?, ?)", signatures)
+
+    def close(self) -> None:
+        self.conn.close()
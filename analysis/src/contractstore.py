@@ -1,5 +1,11 @@
 from contract import Contract
+from contractcache import ContractCache
+from blockindex import BlockIndex
 from scanwrapper import EthContractScanner, BSCContractScanner, PolyContractScanner
+from scheduler import Priority
+from errors import InvalidRequest
+from concurrent.futures import Future
+from typing import Dict, Iterable
 
 
 class ContractStore():
@@ -9,19 +15,26 @@ class ContractStore():
 
         Params:
         - scanner (The API scanner to use (BSCCOntractScanner, EthContractScanner, etc))
+        - cache (Optional persistent ContractCache checked before the *Scan APIs)
+        - block_index (Optional BlockIndex of the chain checked before the *Scan block lookups)
     """
 
-    def __init__(self, scanner: BSCContractScanner | EthContractScanner | PolyContractScanner):
+    def __init__(self, scanner: BSCContractScanner | EthContractScanner | PolyContractScanner, cache: ContractCache = None,
+                 block_index: BlockIndex = None):
         self.contracts: dict[str, Contract] = {}
+        self.pending: Dict[str, Future] = {}
         self.scanner = scanner
+        self.cache = cache
+        self.block_index = block_index
 
-    def get_contract(self, address: str) -> Contract:
+    def get_contract(self, address: str, priority: Priority = Priority.CRITICAL) -> Contract:
         """
-            Checks to see if the contract first exists locally, then checks the *Scan APIs to see if the contract can be loaded.
-            If the contract is not loaded, none is returned
+            Checks to see if the contract first exists locally, then in the persistent cache, then checks the *Scan APIs
+            to see if the contract can be loaded. If the contract is not loaded, none is returned
 
             Params:
             - address: the address of the contract to load
+            - priority: the priority to schedule the lookup with if it is not loaded yet (default Priority.CRITICAL)
         """
 
         contract: Contract = None
@@ -29,22 +42,134 @@ class ContractStore():
         if address in self.contracts:
             contract = self.contracts[address]
         else:
-            contract = self.scanner.get_contract(address)
+            future = self.pending.pop(address, None)
+
+            # a prefetched lookup that has not started yet is rescheduled at the higher priority
+            if future is None or (priority < future.priority and future.cancel()):
+                future = self.__submit(address, priority)
+
+            contract = self.scanner.wait(future)
 
             self.contracts[address] = contract
 
         return contract
 
+    def get_contracts(self, addresses: Iterable[str], priority: Priority = Priority.SPECULATIVE) -> Dict[str, Contract]:
+        """
+            Loads multiple contracts concurrently, returning a mapping between each address that
+            has a verified contract and its Contract object
+
+            Params:
+            - addresses: the addresses of the contracts to load
+            - priority: the priority to schedule the lookups with (default Priority.SPECULATIVE)
+        """
+        addresses = list(addresses)
+
+        self.prefetch(addresses, priority)
+
+        res = {}
+
+        for address in addresses:
+            contract = self.get_contract(address, priority)
+
+            if contract is not None:
+                res[address] = contract
+
+        return res
+
+    def is_unverified(self, address: str) -> bool:
+        """
+            Returns whether a contract is known to be unverified, either loaded as such or cached
+            as unverified in the persistent cache, without looking it up on the *Scan APIs
+
+            Params:
+            - address: the address of the contract
+        """
+        if address in self.contracts:
+            return self.contracts[address] is None
+
+        if self.cache is None:
+            return False
+
+        return self.cache.get(self.scanner.chain, address, source_code=False) == {}
+
+    def prefetch(self, addresses: Iterable[str], priority: Priority = Priority.SPECULATIVE) -> None:
+        """
+            Schedules the lookup of contracts that are not loaded yet without waiting for them. A later
+            get_contract on the address waits on the scheduled lookup instead of making another request
+
+            Params:
+            - addresses: the addresses of the contracts to load
+            - priority: the priority to schedule the lookups with (default Priority.SPECULATIVE)
+        """
+        for address in addresses:
+            if address not in self.contracts and address not in self.pending:
+                self.pending[address] = self.__submit(address, priority)
+
+    def __submit(self, address: str, priority: Priority) -> Future:
+        future = self.scanner.submit(
+            self.__load_contract, address, priority=priority)
+        future.priority = priority
+
+        return future
+
+    def __load_contract(self, address: str) -> Contract:
+        """
+            Loads a contract from the persistent cache if present, else from the *Scan
+            APIs, storing the raw result in the cache for later runs. The source code of
+            the contract is read from the cache on request
+        """
+        if self.cache is None:
+            return self.scanner.get_contract(address)
+
+        chain = self.scanner.chain
+        info = self.cache.get(chain, address, source_code=False)
+
+        if info is None:
+            try:
+                info = self.scanner.get_contract_info(address)
+            except InvalidRequest:
+                # a failed request is not cached, so the contract is looked up again next run
+                return None
+
+            self.cache.put(chain, address, info)
+
+        if not info:
+            return None
+
+        # the source code is left in the cache and only read if it is requested
+        return Contract(address, lambda: self.cache.get_source_code(chain, address), info['ABI'],
+                        info['ContractName'], info['ConstructorArguments'])
+
     def get_block_timestamp(self, block: int) -> int:
         '''
-            Returns a timestamp of when a block was created, in Unix time 
+            Returns a timestamp of when a block was created, in Unix time. The block index
+            is checked first, and timestamps from *Scan are recorded in it
         '''
-        return self.scanner.get_block_timestamp(block)
+        if self.block_index is None:
+            return self.scanner.get_block_timestamp(block)
+
+        timestamp = self.block_index.get_timestamp(block)
+
+        if timestamp is None:
+            timestamp = self.scanner.get_block_timestamp(block)
+
+            if timestamp is not None:
+                self.block_index.add(block, timestamp)
+
+        return timestamp
 
     def get_closest_block(self, timestamp: int) -> int:
         '''
-            Returns the block that was created the closest to the passed timestamp 
+            Returns the block that was created the closest to the passed timestamp. The block
+            index is searched first, falling back to *Scan if it cannot answer the lookup
         '''
+        if self.block_index is not None:
+            block = self.block_index.get_closest_block(timestamp)
+
+            if block is not None:
+                return block
+
         return self.scanner.get_closest_block(timestamp)
 
     def get_tx_exists(self, tx: str) -> bool:
@@ -48,3 +48,9 @@ class ParamNotFound(BaseException):
     """
         Risen when a parameter is not found in a function or event
     """
+
+
+class DecodeError(BaseException):
+    """
+        Risen when calldata or event data is too short or malformed for the ABI it is decoded with
+    """
@@ -0,0 +1,148 @@
+"""
+    Learns how many destination chain blocks each bridge route takes to relay a transfer, so
+    the destination window searched for a relay can be sized from the delays of the links
+    already confirmed on that route, rather than from a fixed number of blocks
+"""
+
+import math
+import sqlite3
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+
+class LatencyProfile():
+    """
+        Percentile profile of the relay delays observed per route, a (bridge name, source chain,
+        destination chain) key. A delay is the number of destination blocks between the block
+        aligned to the time of the send and the block of its relay
+
+        The windows of a route start at the percentiles of its delays (widened by margin) and
+        expand progressively up to max_range, so a fast route is searched over a few blocks
+        while a slow relay is still found by a later window. Routes with fewer than min_samples
+        delays start at default_range. Delays are kept in sqlite (in memory by default), so the
+        profile can be carried across runs, keeping the maxlen most recent delays of each route
+
+        Params:
+        - filepath: the sqlite file to persist the delays to (default in memory)
+        - percentiles: the percentiles of the delays the windows are sized from (default 50, 90, 99)
+        - margin: the factor the percentile windows are widened by (default 1.5)
+        - min_samples: the number of delays a route needs before its percentiles are used (default 10)
+        - default_range: the first window of a route without enough delays (default 100)
+        - min_range: the smallest window (default 5)
+        - max_range: the largest window, past which a relay is not searched for (default 1600)
+        - maxlen: the number of most recent delays kept per route (default 1000)
+    """
+
+    def __init__(self, filepath: str = ":memory:", percentiles: Tuple[float] = (50, 90, 99), margin: float = 1.5,
+                 min_samples: int = 10, default_range: int = 100, min_range: int = 5, max_range: int = 1600,
+                 maxlen: int = 1000) -> None:
+        self.filepath = filepath
+        self.percentiles = percentiles
+        self.margin = margin
+        self.min_samples = min_samples
+        self.default_range = default_range
+        self.min_range = min_range
+        self.max_range = max_range
+        self.maxlen = maxlen
+
+        self.delays: Dict[Tuple[str, int, int], Deque[int]] = {}
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+
+        self.__load()
+
+    def __load(self) -> None:
+        """
+            Creates the delay table if it does not exist, then loads the most recent delays
+            of every route
+        """
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS delays ("
+                "id INTEGER PRIMARY KEY, "
+                "bridge TEXT NOT NULL, "
+                "src INTEGER NOT NULL, "
+                "dest INTEGER NOT NULL, "
+                "delay INTEGER NOT NULL)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS delays_route ON delays (bridge, src, dest, id)")
+
+        for bridge, src, dest, delay in self.conn.execute("SELECT bridge, src, dest, delay FROM delays ORDER BY id"):
+            self.__get_delays((bridge, src, dest)).append(delay)
+
+    def __get_delays(self, key: Tuple[str, int, int]) -> Deque[int]:
+        if key not in self.delays:
+            self.delays[key] = deque(maxlen=self.maxlen)
+
+        return self.delays[key]
+
+    def record(self, bridge: str, src_chain: int, dest_chain: int, delay: int) -> None:
+        '''
+            Records the delay of a confirmed link
+
+            @param bridge : the name of the bridge
+            @param src_chain : the chain of the send
+            @param dest_chain : the chain of the relay
+            @param delay : the number of destination blocks between the send and its relay
+        '''
+        key = (bridge, int(src_chain), int(dest_chain))
+
+        with self.lock, self.conn:
+            self.__get_delays(key).append(max(0, delay))
+            self.conn.execute("INSERT INTO delays (bridge, src, dest, delay) VALUES (?, ?, ?, ?)",
+                              (*key, max(0, delay)))
+
+            # only the delays kept in memory are kept in the table
+            self.conn.execute("DELETE FROM delays WHERE bridge = ? AND src = ? AND dest = ? AND id <= "
+                              "(SELECT id FROM delays WHERE bridge = ? AND src = ? AND dest = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                              (*key, *key, self.maxlen))
+
+    def get_percentile(self, bridge: str, src_chain: int, dest_chain: int, percentile: float) -> int | None:
+        '''
+            Returns a percentile of the delays of a route (nearest rank), or None without delays
+        '''
+        delays = sorted(self.delays.get(
+            (bridge, int(src_chain), int(dest_chain)), []))
+
+        if len(delays) == 0:
+            return None
+
+        return delays[min(len(delays) - 1, max(0, math.ceil(percentile / 100 * len(delays)) - 1))]
+
+    def get_windows(self, bridge: str, src_chain: int, dest_chain: int) -> List[int]:
+        '''
+            Returns the increasing windows, in destination blocks after the aligned block, to
+            search for the relay of a send in. Each window is only searched when no relay was
+            found in the previous one
+
+            @param bridge : the name of the bridge
+            @param src_chain : the chain of the send
+            @param dest_chain : the chain of the relay
+        '''
+        delays = self.delays.get((bridge, int(src_chain), int(dest_chain)), [])
+
+        if len(delays) < self.min_samples:
+            windows = [self.default_range]
+        else:
+            windows = [math.ceil(self.get_percentile(bridge, src_chain, dest_chain, p) * self.margin)
+                       for p in self.percentiles]
+            windows.append(2 * max(delays))
+
+        # past the profile, double the window until max_range
+        while windows[-1] < self.max_range:
+            windows.append(2 * max(windows[-1], self.min_range))
+
+        res = []
+
+        for window in windows:
+            window = min(max(window, self.min_range), self.max_range)
+
+            if len(res) == 0 or window > res[-1]:
+                res.append(window)
+
+        return res
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,292 @@
+"""
+    Joins the source sends and destination relays of a bridge into linked transfers. Rows
+    are plain dicts in the srcHash ... / destHash ... format of the Endpoint token transfers,
+    joined either per loaded batch or incrementally as a stream
+"""
+
+import json
+import sqlite3
+from collections import deque
+from typing import Dict, List, Tuple
+
+
+def link_by_transfer_id(src_rows: List[Dict[str, object]], dest_rows: List[Dict[str, object]]) -> Tuple[List[Dict[str, object]], List[Dict[str, object]], List[Dict[str, object]]]:
+    '''
+        Links source and destination rows on their transferId with a single hash join. A
+        source row with a transferId is linked to the destination row carrying the same id,
+        and is kept unlinked (without destination columns) when there is none, as the id
+        rules out every other candidate
+
+        @param src_rows : the source rows, with the transferId of the send (None if unknown)
+        @param dest_rows : the destination rows, with the source transferId of the relay (None if unknown)
+
+        @returns the rows linked by id, and the source and destination rows left for a
+        fuzzy join: source rows without an id, and destination rows not claimed by an id
+    '''
+    dests: Dict[str, Dict[str, object]] = {}
+
+    for row in dest_rows:
+        if row.get('transferId') is not None:
+            dests.setdefault(row['transferId'], row)
+
+    linked = []
+    src_rest = []
+    claimed = set()
+
+    for row in src_rows:
+        transfer_id = row.get('transferId')
+
+        if transfer_id is None:
+            src_rest.append(row)
+        elif transfer_id in dests:
+            linked.append({**dests[transfer_id], **row})
+            claimed.add(transfer_id)
+        else:
+            linked.append(dict(row))
+
+    dest_rest = [row for row in dest_rows if row.get(
+        'transferId') not in claimed]
+
+    return linked, src_rest, dest_rest
+
+
+def link_asof(src_rows: List[Dict[str, object]], dest_rows: List[Dict[str, object]], tolerance: int) -> List[Dict[str, object]]:
+    '''
+        Links time ordered sends and relays in bulk. Transfers carrying a transfer id are first
+        linked by link_by_transfer_id, then every remaining send is linked to the first relay to
+        the same destChainId and destReceiver at or after it, within tolerance seconds. Sends
+        and relays are walked in time order per (destChainId, destReceiver) with two pointers,
+        so each relay is claimed by at most one send
+
+        @param src_rows : the sends, with their srcTimestamp
+        @param dest_rows : the relays, with their destTimestamp
+        @param tolerance : the maximum delay in seconds between a send and its relay
+
+        @returns the linked rows, with sends without a relay kept unlinked
+    '''
+    linked, src_rest, dest_rest = link_by_transfer_id(src_rows, dest_rows)
+
+    relays: Dict[tuple, deque] = {}
+
+    for row in sorted(dest_rest, key=lambda i: int(i['destTimestamp'])):
+        relays.setdefault((row['destChainId'], row['destReceiver']), deque()).append(row)
+
+    for row in sorted(src_rest, key=lambda i: int(i['srcTimestamp'])):
+        timestamp = int(row['srcTimestamp'])
+        waiting = relays.get((row['destChainId'], row['destReceiver']))
+
+        # sends are walked in time order, so relays before this send can not be claimed anymore
+        while waiting and int(waiting[0]['destTimestamp']) < timestamp:
+            waiting.popleft()
+
+        if waiting and int(waiting[0]['destTimestamp']) - timestamp <= tolerance:
+            linked.append({**waiting.popleft(), **row})
+        else:
+            linked.append(dict(row))
+
+    return linked
+
+
+class IncrementalLinker():
+    """
+        Links source sends and destination relays as they arrive, instead of re-joining every
+        loaded transfer. Sends waiting for their relay and relays waiting for their send are
+        indexed per bridge, so a match is emitted the moment its counterpart is added.
+        Transfers carrying a transfer id are keyed on the id alone, as the receiver of a row
+        is taken from its first token transfer and may differ between the two sides. Transfers
+        without an id share the key of their destination chain and receiver, and are matched
+        first in, first out. Token addresses differ between chains, so the token is not part
+        of the key
+
+        The state is kept in sqlite (in memory by default) so a stream can be resumed after a
+        restart. Entries are expired once the block-time watermark, the latest timestamp
+        reached on both the source and the destination side, passes them by ttl seconds
+
+        Params:
+        - filepath: the sqlite file to persist the state to (default in memory)
+        - ttl: the number of seconds a send or relay waits for its counterpart (default 1 day)
+    """
+
+    def __init__(self, filepath: str = ":memory:", ttl: int = 86400) -> None:
+        self.filepath = filepath
+        self.ttl = ttl
+
+        # side -> key -> [(id, timestamp, row)], in arrival order. Keys start with the bridge
+        self.pending: Dict[str, Dict[tuple, List[tuple]]] = {
+            "send": {}, "relay": {}}
+        self.seen = set()
+
+        self.watermarks = {"send": 0, "relay": 0}
+
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+
+        self.__load()
+
+    def __load(self) -> None:
+        """
+            Creates the state tables if they do not exist, then loads the persisted state
+        """
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                "id INTEGER PRIMARY KEY, "
+                "side TEXT NOT NULL, "
+                "bridge TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "timestamp INTEGER NOT NULL, "
+                "row TEXT NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen ("
+                "bridge TEXT NOT NULL, "
+                "hash TEXT NOT NULL, "
+                "timestamp INTEGER NOT NULL, "
+                "PRIMARY KEY (bridge, hash))")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                "side TEXT PRIMARY KEY, "
+                "timestamp INTEGER NOT NULL)")
+
+        for _id, side, key, timestamp, row in self.conn.execute("SELECT id, side, key, timestamp, row FROM pending ORDER BY id"):
+            self.pending[side].setdefault(tuple(json.loads(key)), []).append(
+                (_id, timestamp, json.loads(row)))
+
+        self.seen.update(self.conn.execute("SELECT bridge, hash FROM seen"))
+        self.watermarks.update(self.conn.execute(
+            "SELECT side, timestamp FROM watermarks"))
+
+    def __len__(self) -> int:
+        return sum(len(i) for side in self.pending.values() for i in side.values())
+
+    @staticmethod
+    def get_key(bridge: str, row: Dict[str, object]) -> tuple:
+        '''
+            Returns the key a send or relay is matched on: the bridge and transfer id if the row
+            has one, else the bridge, destination chain and receiver
+        '''
+        if row.get('transferId') is not None:
+            return (bridge, row['transferId'])
+
+        return (bridge, row['destChainId'], row['destReceiver'])
+
+    def has_seen(self, bridge: str, _hash: str) -> bool:
+        '''
+            Returns whether a transaction was already added for a bridge
+        '''
+        return (bridge, _hash) in self.seen
+
+    def add_send(self, row: Dict[str, object], timestamp: int, bridge: str = "") -> Dict[str, object] | None:
+        '''
+            Adds a source send, in the get_src_rows format
+
+            @param row : the source row
+            @param timestamp : the block timestamp of the send
+            @param bridge : the name of the bridge of the send
+
+            @returns the linked row if its relay was already added, else None
+        '''
+        return self.__add("send", "relay", bridge, row['srcHash'], row, timestamp)
+
+    def add_relay(self, row: Dict[str, object], timestamp: int, bridge: str = "") -> Dict[str, object] | None:
+        '''
+            Adds a destination relay, in the get_dest_rows format
+
+            @param row : the destination row
+            @param timestamp : the block timestamp of the relay
+            @param bridge : the name of the bridge of the relay
+
+            @returns the linked row if its send was already added, else None
+        '''
+        return self.__add("relay", "send", bridge, row['destHash'], row, timestamp)
+
+    def __add(self, side: str, other: str, bridge: str, _hash: str, row: Dict[str, object], timestamp: int) -> Dict[str, object] | None:
+        """
+            Claims the oldest counterpart waiting under the key of the row, or leaves the
+            row waiting for its counterpart. A transaction already added is ignored, as
+            destination windows of nearby sends overlap
+        """
+        if self.has_seen(bridge, _hash):
+            return None
+
+        key = self.get_key(bridge, row)
+
+        with self.conn:
+            self.seen.add((bridge, _hash))
+            self.conn.execute(
+                "INSERT OR IGNORE INTO seen VALUES (?, ?, ?)", (bridge, _hash, timestamp))
+
+            self.__advance(side, timestamp)
+
+            waiting = self.pending[other].get(key)
+
+            if waiting:
+                _id, _, match = waiting.pop(0)
+
+                if len(waiting) == 0:
+                    del self.pending[other][key]
+
+                self.conn.execute("DELETE FROM pending WHERE id = ?", (_id,))
+
+                return {**match, **row}
+
+            cursor = self.conn.execute("INSERT INTO pending (side, bridge, key, timestamp, row) VALUES (?, ?, ?, ?, ?)",
+                                       (side, bridge, json.dumps(key), timestamp, json.dumps(row)))
+
+            self.pending[side].setdefault(key, []).append(
+                (cursor.lastrowid, timestamp, row))
+
+        return None
+
+    def __advance(self, side: str, timestamp: int) -> None:
+        if timestamp > self.watermarks[side]:
+            self.watermarks[side] = timestamp
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (side, timestamp))
+
+    def get_watermark(self) -> int:
+        '''
+            Returns the block time both sides of the stream have reached
+        '''
+        return min(self.watermarks.values())
+
+    def expire(self, bridge: str = None) -> List[Dict[str, object]]:
+        '''
+            Drops the sends, relays and seen transactions of a bridge more than ttl seconds
+            behind the watermark
+
+            @param bridge : the bridge to expire the entries of (default every bridge)
+
+            @returns the rows of the expired sends, which were never relayed
+        '''
+        cutoff = self.get_watermark() - self.ttl
+        expired = []
+
+        with self.conn:
+            for side, pending in self.pending.items():
+                for key in list(pending):
+                    if bridge is not None and key[0] != bridge:
+                        continue
+
+                    kept = [i for i in pending[key] if i[1] >= cutoff]
+
+                    if side == "send":
+                        expired.extend(i[2]
+                                       for i in pending[key] if i[1] < cutoff)
+
+                    if len(kept) > 0:
+                        pending[key] = kept
+                    else:
+                        del pending[key]
+
+            # without a bridge, the entries of every bridge are dropped
+            self.conn.execute("DELETE FROM pending WHERE timestamp < ? AND (? IS NULL OR bridge = ?)",
+                              (cutoff, bridge, bridge))
+
+            self.seen.difference_update(self.conn.execute(
+                "SELECT bridge, hash FROM seen WHERE timestamp < ? AND (? IS NULL OR bridge = ?)", (cutoff, bridge, bridge)))
+            self.conn.execute("DELETE FROM seen WHERE timestamp < ? AND (? IS NULL OR bridge = ?)",
+                              (cutoff, bridge, bridge))
+
+        return expired
+
+    def close(self) -> None:
+        self.conn.close()
@@ -3,13 +3,23 @@
 """
 
 import os
-from scanwrapper import BSCContractScanner, EthContractScanner
+import sys
+import json
+import csv
+from scanwrapper import BSCContractScanner, EthContractScanner, PolyContractScanner
 import argparse
 from argparse import RawTextHelpFormatter
 from mgowrapper import MongoFetcher
 from transaction import Transaction
 from contractstore import ContractStore
-from bridge import Bridges
+from contractcache import ContractCache, CONTRACTCACHE
+from blockindex import BlockIndex, BLOCKINDEX
+from signatures import registry
+from signaturedb import get_signature_db, SIGNATUREDB
+from bridge import Bridges, Chains, LINKED_COLUMNS, SRC_COLUMNS
+from linker import IncrementalLinker
+from windowcache import WindowCache
+from latency import LatencyProfile
 import pandas as pd
 
 parser = argparse.ArgumentParser(description=("Contract parser for XScan apis (etherscan, bscscan, etc)"
@@ -18,9 +28,26 @@ parser = argparse.ArgumentParser(description=("Contract parser for XScan apis (e
                                               "program will exit\n"
                                               "\nUsage:\n-python contractscanner.py -tx {TX_HASH}"
                                               "\n-python contractscanner.py --chains bsc -tx {TX_HASH}"
-                                              "\n-python contractscanner.py  --chains bsc -bk YOUR_BSCSCAN_API_KEY -tx {TX_HASH}"), formatter_class=RawTextHelpFormatter)
-parser.add_argument('-tx', '--transaction', type=str,
-                    help="the transaction to scan for")
+                                              "\n-python contractscanner.py  --chains bsc -bk YOUR_BSCSCAN_API_KEY -tx {TX_HASH}"
+                                              "\n-python contractscanner.py --chains eth bsc -txf {FILE_OF_TX_HASHES}"
+                                              "\n-python contractscanner.py --chains eth bsc -txq '{\"block\": 15000000}' -txc eth"), formatter_class=RawTextHelpFormatter)
+txGroup = parser.add_mutually_exclusive_group(required=True)
+txGroup.add_argument('-tx', '--transaction', type=str,
+                     help="the transaction to scan for")
+txGroup.add_argument('-txf', '--txFile', type=str,
+                     help="file of transaction hashes to scan for, one per line (- for stdin)")
+txGroup.add_argument('-txq', '--txQuery', type=str,
+                     help="mongodb query (as JSON) selecting the transactions to scan for, requires --txChain")
+txGroup.add_argument('-bs', '--blockStart', type=int,
+                     help="first block of the source chain to stream bridge sends from, requires --blockEnd and --txChain")
+parser.add_argument('-be', '--blockEnd', type=int,
+                    help="last block of the source chain to stream bridge sends from")
+parser.add_argument('-bulk', '--bulk', action='store_true',
+                    help="With blockStart / blockEnd, extract every send and relay of the range up front and link them\nwith a single as-of join, instead of streaming block by block")
+parser.add_argument('-rd', '--relayDelay', type=int, default=3600,
+                    help="The maximum delay in seconds between a send and its relay in bulk mode, default 3600")
+parser.add_argument('-txc', '--txChain', type=str,
+                    help="The chain of the transactions scanned for, determined per transaction if not set")
 parser.add_argument('-bk', '--bscKey', type=str,
                     help="API Key to use for BSC Scan.")
 parser.add_argument('-ek', '--ethKey', type=str,
@@ -31,6 +58,20 @@ parser.add_argument('-db', '--database', type=str,
                     help="The database to use for mongodb scanning", required=True)
 parser.add_argument('-o', '--output', type=str,
                     help="Filepath to output results to as a CSV, default stdout")
+parser.add_argument('-cc', '--contractCache', type=str, default=CONTRACTCACHE,
+                    help="Filepath of the sqlite cache for *Scan contracts, default ./contracts.db")
+parser.add_argument('-bi', '--blockIndex', type=str, default=BLOCKINDEX,
+                    help="Directory of the local block -> timestamp indexes, default ./blockindex")
+parser.add_argument('-sd', '--signatureDB', type=str, default=SIGNATUREDB,
+                    help="Directory of the local selector / topic signature database, default ./signaturedb")
+parser.add_argument('-ls', '--linkState', type=str,
+                    help="Sqlite file of the incremental linker state. When set, sends and relays are linked incrementally\nacross transactions and runs, keyed on the transfer id")
+parser.add_argument('-eo', '--expiredOutput', type=str,
+                    help="Filepath to write the sends the incremental linker gave up on to as a CSV, default stderr")
+parser.add_argument('-wb', '--windowBudget', type=int, default=10000,
+                    help="The number of destination candidates kept in the cache of scanned destination windows, default 10000.\n0 disables the cache")
+parser.add_argument('-lp', '--latencyProfile', type=str, default=":memory:",
+                    help="Sqlite file of the relay delays learned per bridge route, which size the destination windows.\nKept in memory by default")
 parser.add_argument('-c', "--chains", nargs='+',
                     help="Chains sto run analysis on \n Supported options:\n-eth\n-bsc\n", required=True)
 
@@ -40,6 +81,11 @@ bscStore = None
 ethStore = None
 polygonStore = None
 
+contractCache = ContractCache(args.contractCache)
+registry.attach(contractCache)
+
+get_signature_db(args.signatureDB)
+
 bscFetcher = MongoFetcher(args.database, "bsc")
 ethFetcher = MongoFetcher(args.database, "eth")
 polygonFetcher = MongoFetcher(args.database, "poly")
@@ -47,23 +93,102 @@ polygonFetcher = MongoFetcher(args.database, "poly")
 if "bsc" in args.chains:
     bscApiKey = bscApiKey = os.getenv(
         "bscApiKey") if args.bscKey == None else args.bscKey
-    bscStore = ContractStore(BSCContractScanner(bscApiKey))
+    bscStore = ContractStore(BSCContractScanner(bscApiKey), contractCache,
+                             BlockIndex("bsc", args.blockIndex))
 
 if "eth" in args.chains:
     ethApiKey = ethApiKey = os.getenv(
         "ethApiKey") if args.ethKey == None else args.ethKey
-    ethStore = ContractStore(EthContractScanner(ethApiKey))
+    ethStore = ContractStore(EthContractScanner(ethApiKey), contractCache,
+                             BlockIndex("eth", args.blockIndex))
 
 if "poly" in args.chains or "polygon" in args.chains:
     polyApiKey = polyApiKey = os.getenv(
         "polyApiKey") if args.polyKey == None else args.polyKey
-    polygonStore = ContractStore(PolyContractScanner(polyApiKey))
+    polygonStore = ContractStore(PolyContractScanner(polyApiKey), contractCache,
+                                 BlockIndex("poly", args.blockIndex))
+
+linker = IncrementalLinker(args.linkState) if args.linkState else None
+windowCache = WindowCache(args.windowBudget) if args.windowBudget > 0 else None
+latency = LatencyProfile(args.latencyProfile)
 
 bridges = Bridges(ethStore, bscStore, polygonStore,
-                  "./src/bridges2.json", bscFetcher, ethFetcher, polygonFetcher, args.chains)
+                  "./src/bridges2.json", bscFetcher, ethFetcher, polygonFetcher, args.chains, linker, windowCache, latency)
+
+fetchers = {"bsc": bscFetcher, "eth": ethFetcher,
+            "poly": polygonFetcher, "polygon": polygonFetcher}
+
+txChain = Chains.resolve_name(args.txChain) if args.txChain else None
+
+if args.blockStart is not None:
+    if txChain is None or args.blockEnd is None:
+        parser.error("--blockStart requires --blockEnd and --txChain")
+
+expiredOutput = None
+expiredWriter = None
+
+if linker is not None:
+    expiredOutput = open(args.expiredOutput, "w", newline="") if args.expiredOutput else sys.stderr
+    expiredWriter = csv.DictWriter(
+        expiredOutput, fieldnames=SRC_COLUMNS, extrasaction="ignore")
+    expiredWriter.writeheader()
+
+
+def writeExpired() -> None:
+    """
+        Writes out the sends the incremental linker gave up on since the last call
+    """
+    if expiredWriter is None:
+        return
+
+    for row in bridges.pop_expired_transactions().to_dict('records'):
+        expiredWriter.writerow(row)
+
+    expiredOutput.flush()
+
+
+if args.blockStart is not None and args.bulk:
+    res = bridges.bulk_link(args.txChain, args.blockStart,
+                            args.blockEnd, args.relayDelay)
+
+    bridges.output_transaction(filename=args.output or "", res=res)
+elif args.blockStart is not None:
+    # rows are written as they are linked, so a long range never has to be held in memory
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.DictWriter(
+        output, fieldnames=LINKED_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+
+    for row in bridges.stream_block_range(args.txChain, args.blockStart, args.blockEnd):
+        writer.writerow(row)
+        output.flush()
+
+        writeExpired()
+else:
+    if args.transaction:
+        hashes = [args.transaction]
+    elif args.txFile:
+        txFile = sys.stdin if args.txFile == "-" else open(args.txFile, "r")
+        hashes = [i.strip() for i in txFile if i.strip() != ""]
+    else:
+        if txChain is None:
+            parser.error("--txQuery requires --txChain")
+
+        hashes = fetchers[args.txChain].get_tx_hashes(json.loads(args.txQuery))
+
+    res = bridges.link_many(hashes, txChain)
+
+    bridges.output_transaction(filename=args.output or "", res=res)
+
+writeExpired()
+
+for store in [bscStore, ethStore, polygonStore]:
+    if store is not None:
+        store.block_index.save()
 
-bridges.load_transaction(args.transaction)
+registry.save()
 
-bridges.link_transaction()
+latency.close()
 
-bridges.output_transaction(filename=args.output or "")
+if linker is not None:
+    linker.close()
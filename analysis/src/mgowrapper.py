@@ -1,8 +1,70 @@
-from typing import Iterable
-from pymongo import MongoClient, CursorType
+import argparse
+import pprint
+from typing import Dict, Iterable, Iterator, List
+from pymongo import ASCENDING, MongoClient, CursorType
+from pymongo.errors import OperationFailure
+from Crypto.Hash import keccak
 
 MONGOURI = "mongodb://127.0.0.1"
 
+# projections splitting a transaction document into its small header fields and the
+# function / event / transfer traces, which can be several MB each
+HEADER_FIELDS = {"tx": 1, "to": 1, "from": 1, "value": 1,
+                 "gasprice": 1, "gasused": 1, "block": 1, "_id": 0}
+TRACE_FIELDS = {"functrace": 1, "eventtrace": 1,
+                "transferlogs": 1, "_id": 0}
+
+
+def to_checksum_address(address: str) -> str:
+    '''
+        Returns the EIP-55 checksummed form of an address, in which the logger writes the
+        top level "to" and "from" of each transaction document
+    '''
+    address = address.lower().removeprefix("0x")
+
+    k = keccak.new(digest_bits=256)
+    k.update(address.encode())
+    digest = k.hexdigest()
+
+    return "0x" + "".join(c.upper() if int(h, 16) >= 8 else c for c, h in zip(address, digest))
+
+
+def get_call_pattern(address: str, selectors: List[str]) -> str:
+    '''
+        Returns a regex matching a functrace row that calls one of the function selectors
+        at address. Rows are formatted index,calltype,depth,from,to,value,gas,input,... and
+        the logger writes checksummed addresses, so the regex should be matched ignoring case
+    '''
+    return f",{address},[^,\\n]*,[^,\\n]*,0x(?:{'|'.join(selectors)})"
+
+
+def get_calls_query(patterns: List[str]) -> dict:
+    '''
+        Returns a query matching the transactions whose functrace matches one of the call
+        patterns (see get_call_pattern), ignoring case
+    '''
+    return {"functrace": {"$regex": "|".join(f"(?:{pattern})" for pattern in patterns), "$options": "i"}}
+
+
+def get_block_range_query(start: int, end: int, to_address: str = None, selectors: List[str] = None) -> dict:
+    '''
+        Returns the query of the transactions from block start to block end (inclusive). Passing
+        to_address only matches the transactions sent to it, and passing selectors with it only
+        those whose functrace calls one of the selectors at to_address
+    '''
+    query = {"block": {"$lte": end, "$gte": start}}
+
+    if to_address != None:
+        # the logger writes checksummed addresses, while the bridge file may not be
+        query["to"] = {"$in": list(dict.fromkeys(
+            [to_checksum_address(to_address), to_address.lower()]))}
+
+        if selectors is not None:
+            query.update(get_calls_query(
+                [get_call_pattern(to_address, selectors)]))
+
+    return query
+
 
 class MongoFetcher():
     '''
@@ -16,44 +78,250 @@ class MongoFetcher():
         self.collection = self.db[collection]
         self.block: int = 1
 
-    def get_block(self, n: int = None) -> None:
+    def get_block(self, n: int = None, projection: dict = None) -> None:
         '''
             Gets all transactions in the mongodb at a certain index 
             N is an optional argument that ifnot specified, we will read
-            in the next block 
+            in the next block. Projection limits the returned fields
         '''
         if n == None:
             n = self.block
 
-        txs = self.collection.find({"block": str(n)})
+        txs = self.collection.find({"block": int(n)}, projection)
 
         self.block = n + 1
 
         return txs
 
-    def get_tx(self, tx: str = "") -> Iterable[CursorType]:
+    def iter_blocks(self, start: int, end: int, projection: dict = None, query: dict = None, batch_blocks: int = 1000,
+                    batch_size: int = 100) -> Iterator[dict]:
+        '''
+            Yields every transaction from block start to block end (inclusive) in block order,
+            reading batch_blocks blocks per query through a cursor of batch_size documents per
+            round trip. Passing a query only yields the transactions also matching it, such as
+            a functrace regex matched within mongodb
+        '''
+        for i in range(start, end + 1, batch_blocks):
+            block_query = get_block_range_query(i, min(i + batch_blocks - 1, end))
+
+            yield from self.collection.find({**(query or {}), **block_query}, projection,
+                                            batch_size=batch_size).sort("block", 1)
+
+        self.block = end + 1
+
+    def get_tx(self, tx: str = "", projection: dict = None) -> Iterable[CursorType]:
         '''
             Gets a single transaction based on the tx argument, which is the 
-            hash of the transaction
+            hash of the transaction. Projection limits the returned fields, such
+            as to HEADER_FIELDS or TRACE_FIELDS
         '''
 
         if tx == "":
             return list(self.collection.aggregate([{"$sample": {"size": 1}}]))[0]
 
-        return self.collection.find_one({"tx": tx})
+        return self.collection.find_one({"tx": tx}, projection)
+
+    def probe_calls(self, tx: str, address: str, selectors: List[str]) -> bool:
+        '''
+            Returns whether a transaction calls one of the function selectors at address.
+            The functrace is matched within mongodb, so only a boolean is transferred
+        '''
+
+        res = list(self.collection.aggregate([
+            {"$match": {"tx": tx}},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "calls": {"$regexMatch": {
+                "input": "$functrace", "regex": get_call_pattern(address, selectors), "options": "i"}}}}
+        ]))
+
+        return len(res) > 0 and res[0]['calls']
+
+    def get_block_range(self, start: int, end: int, to_address: str = None, limit: int = 1000, projection: dict = None,
+                        batch_size: int = 100, selectors: List[str] = None):
+        """
+            Gets all transaction hashes by a block range. Passing a projection returns those fields
+            of each document instead, read through a cursor of batch_size documents per round trip.
+            Passing selectors with to_address only returns the transactions whose functrace calls
+            one of the selectors at to_address, matched within mongodb
+        """
+
+        query = get_block_range_query(start, end, to_address, selectors)
+
+        return self.collection.find(query, projection or {"tx": 1, "_id": 0}, limit=limit, batch_size=batch_size)
+
+    def get_txs(self, txs: Iterable[str], projection: dict = None, batch_size: int = 100) -> Iterator[dict]:
+        """
+            Yields the documents of multiple transactions, fetched with one $in query per
+            batch_size hashes instead of one query per hash. Hashes that are not found are skipped
+        """
+
+        txs = list(txs)
+
+        for i in range(0, len(txs), batch_size):
+            yield from self.collection.find({"tx": {"$in": txs[i:i + batch_size]}}, projection, batch_size=batch_size)
+
+    def has_tx(self, tx: str) -> bool:
+        """
+            Returns whether a transaction hash is present in the collection
+        """
+
+        return self.collection.count_documents({"tx": tx}, limit=1) > 0
+
+    def get_tx_hashes(self, query: dict, limit: int = 0) -> Iterable[str]:
+        """
+            Yields the hash of every transaction matching a mongodb query
+        """
+
+        for tx in self.collection.find(query, {"tx": 1, "_id": 0}, limit=limit):
+            yield tx['tx']
+
+    def migrate_block_field(self) -> int:
+        """
+            Converts every block field stored as a string into an integer, so that the
+            equality and range queries on block can share one index
+
+            Returns:
+            - the number of migrated documents
+        """
+
+        res = self.collection.update_many({"block": {"$type": "string"}}, [
+                                          {"$set": {"block": {"$toInt": "$block"}}}])
+
+        return res.modified_count
+
+    def ensure_indexes(self) -> List[str]:
+        """
+            Creates the indexes used by the fetcher's queries, if they do not exist:
+            - (block, to, tx), used by get_block, get_block_range and iter_blocks
+            - a unique index on tx, used by get_tx, get_txs and has_tx
+
+            When the collection already holds the same tx more than once, the unique index
+            cannot be built, so a non unique index on tx is created instead and the duplicated
+            hashes are returned, to be removed before indexing again
+
+            Returns:
+            - the duplicated transaction hashes, empty when the unique index was created
+        """
+
+        self.collection.create_index(
+            [("block", ASCENDING), ("to", ASCENDING), ("tx", ASCENDING)], name="block_to_tx")
+
+        try:
+            self.collection.create_index("tx", unique=True, name="tx_unique")
+        except OperationFailure as e:
+            # 11000 is the duplicate key error
+            if e.code != 11000:
+                raise
+
+            self.collection.create_index("tx", name="tx")
+
+            return self.find_duplicate_txs()
+
+        return []
 
-    def get_block_range(self, start: int, end: int, to_address: str = None, limit: int = 1000):
+    def find_duplicate_txs(self, limit: int = 100) -> List[str]:
         """
-            Gets all transaction hashes by a block range
+            Returns up to limit transaction hashes stored in more than one document
         """
 
-        query = None
+        res = self.collection.aggregate([
+            {"$group": {"_id": "$tx", "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+            {"$limit": limit}
+        ], allowDiskUse=True)
+
+        return [doc['_id'] for doc in res]
+
+    def explain_queries(self, block: int = None, to_address: str = None, selectors: List[str] = None) -> Dict[str, Dict[str, object]]:
+        """
+            Explains the queries the fetcher runs against the current indexes, built by the same
+            helpers, reporting for each whether it uses an index and whether it is covered
+            (answered from the index without reading any documents)
+
+            Params:
+            - block: the block to run the queries on, default the block of a sampled transaction
+            - to_address: the endpoint of the get_block_range and iter_blocks queries, default
+              the "to" of the sampled transaction
+            - selectors: the function selectors called at to_address, default the selector of
+              the first call of the sampled transaction
+
+            Returns:
+            - a mapping between the query name and its index, covered, keysExamined and docsExamined
+        """
+
+        sample = self.collection.find_one(
+            {} if block is None else {"block": block}, {"tx": 1, "block": 1, "to": 1, "functrace": 1, "_id": 0}) or {}
+
+        block = sample.get("block", block or 0)
+        tx = sample.get("tx", "")
+        to_address = to_address or sample.get("to") or "0x" + "0" * 40
+
+        if selectors is None:
+            # functrace rows are formatted index,calltype,depth,from,to,value,gas,input,...
+            row = sample.get("functrace", "").split("\n")[0].split(",")
+            selectors = [row[7][2:10] if len(row) > 7 else "00000000"]
+
+        queries = {
+            "get_block": self.collection.find({"block": block}),
+            "get_tx": self.collection.find({"tx": tx}).limit(1),
+            "get_txs": self.collection.find({"tx": {"$in": [tx]}}),
+            "get_block_range": self.collection.find(get_block_range_query(block, block, to_address, selectors),
+                                                    {"_id": 0}),
+            "iter_blocks": self.collection.find({**get_calls_query([get_call_pattern(to_address, selectors)]),
+                                                 **get_block_range_query(block, block)}, {"_id": 0}).sort("block", 1),
+        }
+
+        return {name: self.__summarize_explain(cursor.explain()) for name, cursor in queries.items()}
+
+    def __summarize_explain(self, explain: dict) -> Dict[str, object]:
+        stages = []
+        index = None
+
+        stage = explain["queryPlanner"]["winningPlan"]
+        stage = stage.get("queryPlan", stage)
+
+        while stage is not None:
+            stages.append(stage["stage"])
+            index = stage.get("indexName", index)
+            stage = stage.get("inputStage")
+
+        stats = explain.get("executionStats", {})
+
+        return {
+            "index": index,
+            "covered": index is not None and "FETCH" not in stages,
+            "keysExamined": stats.get("totalKeysExamined"),
+            "docsExamined": stats.get("totalDocsExamined"),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrates and indexes the transaction trace collections")
+    parser.add_argument('-db', '--database', type=str, required=True,
+                        help="The database to use for mongodb scanning")
+    parser.add_argument('-c', "--chains", nargs='+', required=True,
+                        help="The collections to migrate and index (eth, bsc, poly)")
+    parser.add_argument('-m', '--migrate', action="store_true",
+                        help="Convert string block fields to integers before indexing")
+    parser.add_argument('-e', '--explain', action="store_true",
+                        help="Report whether the fetcher's queries use and are covered by the indexes")
+
+    args = parser.parse_args()
+
+    for chain in args.chains:
+        fetcher = MongoFetcher(args.database, chain)
+
+        if args.migrate:
+            print(f"{chain}: migrated {fetcher.migrate_block_field()} block fields")
+
+        duplicates = fetcher.ensure_indexes()
+        print(f"{chain}: indexes {list(fetcher.collection.index_information())}")
 
-        if to_address != None:
-            query = self.collection.find({"block": {"$lte": end, "$gte": start}, "to": to_address}, {
-                                         "tx": 1, "_id": 0}, limit=limit)
-        else:
-            query = self.collection.find({"block": {"$lte": end, "$gte": start}}, {
-                                         "tx": 1, "_id": 0}, limit=limit)
+        if len(duplicates) > 0:
+            print(f"{chain}: tx is not unique, the index on tx was created without uniqueness. "
+                  f"Duplicated transactions: {duplicates}")
 
-        return query
+        if args.explain:
+            print(f"{chain}:")
+            pprint.pprint(fetcher.explain_queries())
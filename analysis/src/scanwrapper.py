@@ -5,23 +5,78 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import threading
+import time
 from errors import ContractNotFound, InvalidRequest, BlockNotFound
 from contract import Contract
+from scheduler import Priority, ScanScheduler, get_bucket
+from concurrent.futures import Future
 import pprint
 import json
-from typing import List
+from typing import Any, Callable, List, Dict
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+session: requests.Session = None
+session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    '''
+        Returns the pooled requests Session shared by every scanner, so that
+        connections to the *Scan apis are kept alive between requests
+    '''
+    global session
+
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=4,
+                          pool_maxsize=32))
+
+        return session
 
 
 class BaseContractScanner():
     """
         Wrapper to read information from a *Scan api and return a Contract object that 
-        contains the relevant information about that contract
+        contains the relevant information about that contract. Every request is limited
+        by a token bucket shared by all scanners using the same API key, and lookups can
+        be run concurrently through submit()
+
+        Params:
+        - api_key: the API key to use for the *Scan api
+        - base_url: the url of the *Scan api
+        - rate_limit (Optional): the requests per second permitted for the API key (default rate_limit)
+        - workers (Optional): the number of lookups to run concurrently (default 4)
+        - timeout (Optional): the (connect, read) timeout of a request in seconds (default (5, 30))
+        - retries (Optional): the number of times a rate limited or failed request is retried (default 5)
+        - backoff (Optional): the base delay in seconds of the exponential backoff between retries (default 0.5)
+        - max_backoff (Optional): the maximum delay in seconds between retries (default 30)
     """
 
-    def __init__(self, api_key: str, base_url: str) -> None:
+    chain = ""
+    rate_limit = 5
+
+    def __init__(self, api_key: str, base_url: str, rate_limit: float = None, workers: int = 4,
+                 timeout: float | tuple = (5, 30), retries: int = 5, backoff: float = 0.5, max_backoff: float = 30) -> None:
         self.api_key = api_key
         self.base_url = base_url
 
+        self.session = get_session()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.bucket = get_bucket(
+            self.chain, api_key, rate_limit or self.rate_limit)
+        self.scheduler = ScanScheduler(workers)
+
     def __new__(cls, *args, **kwargs):
         """
             Prevents direct instantiation of the class
@@ -31,20 +86,111 @@ class BaseContractScanner():
                 f"only children of '{cls.__name__}' may be instantiated")
         return object.__new__(cls)
 
-    def get_contract(self, address: str) -> Contract:
+    def __get(self, url: str) -> requests.Response:
         """
-            Returns a Contract object if present in BSCSCan, or None if there 
-            is no verified contract present in BSCScan. In this case, an error is risen also
-            to be caught
+            Performs a GET request against the *Scan api once the rate limit permits it.
+            Rate limited (429 or *Scan's "Max rate limit reached"), 5xx and connection
+            failures are retried with jittered exponential backoff, waiting for the
+            Retry-After header instead when the api sends one. The last response is
+            returned once the retries are exhausted
+        """
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+
+            try:
+                req = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+
+                time.sleep(self.__get_backoff(attempt))
+                continue
+
+            if attempt == self.retries or not self.__is_retryable(req):
+                return req
+
+            retry_after = self.__get_retry_after(req)
+
+            time.sleep(retry_after if retry_after is not None
+                       else self.__get_backoff(attempt))
+
+        return req
+
+    def __is_retryable(self, req: requests.Response) -> bool:
+        """
+            *Scan reports exceeding the rate limit with a 200 status, so the body of
+            successful responses is checked as well
+        """
+        if req.status_code in RETRY_STATUS:
+            return True
+
+        return req.status_code == 200 and b"rate limit reached" in req.content[:256]
+
+    def __get_backoff(self, attempt: int) -> float:
+        """
+            Full jitter exponential backoff, so that concurrent lookups do not retry in lockstep
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __get_retry_after(self, req: requests.Response) -> float | None:
+        """
+            Parses the Retry-After header, given either in seconds or as an HTTP date
+        """
+        retry_after = req.headers.get("Retry-After")
+
+        if retry_after is None:
+            return None
+
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) -
+                         datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+
+        return min(self.max_backoff, max(0, delay))
+
+    def submit(self, fn: Callable, *args, priority: Priority = Priority.NORMAL) -> Future:
+        """
+            Schedules a lookup to run concurrently with other lookups of this scanner.
+            Lookups with a lower priority value are run first
+
+            Params:
+            - fn: the lookup to run, usually one of the get_* methods
+            - priority: the Priority of the lookup (default Priority.NORMAL)
+
+            Returns:
+            - a Future resolving to the result of the lookup
+        """
+        return self.scheduler.submit(fn, *args, priority=priority)
+
+    def wait(self, future: Future) -> Any:
+        """
+            Returns the result of a lookup returned by submit, running it on the calling thread
+            if it has not started yet and the caller is itself one of the scanner's workers,
+            see ScanScheduler.wait
+        """
+        return self.scheduler.wait(future)
+
+    def get_contract_info(self, address: str) -> Dict[str, str] | None:
+        """
+            Returns the raw getsourcecode result for an address, or None if there
+            is no verified contract present in *Scan
 
             Params:
             - address: The address to get the source code for
 
             Returns:
-            - the source code of the address or None if the contract is not veriifed
+            - a dict with the SourceCode, ABI, ContractName and ConstructorArguments of the
+              address or None if the contract is not verified
+
+            Raises:
+            - InvalidRequest if the request failed, so that the failure is not taken as unverified
         """
         try:
-            req = requests.get(
+            req = self.__get(
                 f"{self.base_url}?module=contract&action=getsourcecode&address={address}&apiKey={self.api_key}")
 
             if req.status_code != 200:
@@ -52,22 +198,48 @@ class BaseContractScanner():
                     "The passed paremeters were not valid for this endpoint")
 
             json = req.json()
-            if (('status' in json and json['status'] == '0')
-                    or ('status' in json and json['status'] == '1' and json['result'][0]['SourceCode'] == "")):
+
+            # a status of 0 is a failed request (rate limits, an invalid key, NOTOK), not an
+            # unverified contract, which is a status of 1 with an empty SourceCode
+            if 'status' in json and json['status'] == '0':
+                raise InvalidRequest(
+                    f"The getsourcecode request for {address} failed: {json.get('result')}")
+
+            if 'status' in json and json['status'] == '1' and json['result'][0]['SourceCode'] == "":
                 raise ContractNotFound(
                     "The specified contract was not found for this endpoint")
 
-            res = req.json()['result'][0]
-
-            return Contract(address, res['SourceCode'], res['ABI'], res['ContractName'], res['ConstructorArguments'])
+            return json['result'][0]
         except ContractNotFound:
             return None
 
+    def get_contract(self, address: str) -> Contract:
+        """
+            Returns a Contract object if present in BSCSCan, or None if there 
+            is no verified contract present in BSCScan. In this case, an error is risen also
+            to be caught
+
+            Params:
+            - address: The address to get the source code for
+
+            Returns:
+            - the source code of the address or None if the contract is not veriifed
+        """
+        try:
+            res = self.get_contract_info(address)
+        except InvalidRequest:
+            return None
+
+        if res is None:
+            return None
+
+        return Contract(address, res['SourceCode'], res['ABI'], res['ContractName'], res['ConstructorArguments'])
+
     def get_contracts(self, addresses: List[str]) -> dict[str, str]:
         """
             Returns a dictionary consisting of the mapping between all provided addresses and a
             Contract object of the address if verified. If the contract does not have a verified source
-            code, it is not returned in the dictionary
+            code, it is not returned in the dictionary. The lookups are run concurrently
 
             Params:
             - addresses: The list of addresses to get source code for
@@ -76,10 +248,13 @@ class BaseContractScanner():
             - a mapping between all addresses that have verified source code and a contract object
         """
 
+        futures = {address: self.submit(self.get_contract, address)
+                   for address in addresses}
+
         res = {}
 
-        for address in addresses:
-            contract = self.get_contract(address)
+        for address, future in futures.items():
+            contract = self.wait(future)
 
             if contract != None:
                 res[address] = contract
@@ -126,7 +301,7 @@ class BaseContractScanner():
             @returns a unix timestamp of when a block was created
         """
         try:
-            req = requests.get(
+            req = self.__get(
                 f"{self.base_url}?module=block&action=getblockreward&blockno={block}&apiKey={self.api_key}")
 
             if req.status_code != 200:
@@ -152,7 +327,7 @@ class BaseContractScanner():
             @returns the block number of the most recent block after the timestamp
         """
         try:
-            req = requests.get(
+            req = self.__get(
                 f"{self.base_url}?module=block&action=getblocknobytime&closest=after&timestamp={timestamp}&apiKey={self.api_key}")
 
             if req.status_code != 200:
@@ -175,7 +350,7 @@ class BaseContractScanner():
         """
 
         try:
-            req = requests.get(
+            req = self.__get(
                 f"{self.base_url}?module=transaction&action=getstatus&txhash={tx}&apiKey={self.api_key}")
 
             if req.status_code != 200:
@@ -199,9 +374,11 @@ class BSCContractScanner(BaseContractScanner):
         Wrapper for the BSCScan api
     """
 
-    def __init__(self, api_key: str) -> None:
+    chain = "bsc"
+
+    def __init__(self, api_key: str, **kwargs) -> None:
         super().__init__(api_key,
-                         "https://api.bscscan.com/api")
+                         "https://api.bscscan.com/api", **kwargs)
 
 
 class EthContractScanner(BaseContractScanner):
@@ -209,9 +386,11 @@ class EthContractScanner(BaseContractScanner):
         Wrapper for the EthersScan api
     """
 
-    def __init__(self, api_key: str) -> None:
+    chain = "eth"
+
+    def __init__(self, api_key: str, **kwargs) -> None:
         super().__init__(api_key,
-                         "https://api.etherscan.io/api")
+                         "https://api.etherscan.io/api", **kwargs)
 
 
 class PolyContractScanner(BaseContractScanner):
@@ -219,6 +398,8 @@ class PolyContractScanner(BaseContractScanner):
         Wrapper for the PolyScan api
     """
 
-    def __init__(self, api_key: str) -> None:
+    chain = "poly"
+
+    def __init__(self, api_key: str, **kwargs) -> None:
         super().__init__(api_key,
-                         "https://api.polygonscan.io/api")
+                         "https://api.polygonscan.io/api", **kwargs)
@@ -0,0 +1,160 @@
+"""
+    Defines the rate limiting and request scheduling used by the *Scan scanners, so that
+    lookups can run concurrently without going over the per API key quotas
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from enum import IntEnum
+from queue import PriorityQueue
+from typing import Any, Callable, Dict, Tuple
+
+
+class Priority(IntEnum):
+    """
+        Ordering of scheduled lookups. Lower values are run first
+    """
+    CRITICAL = 0
+    NORMAL = 5
+    SPECULATIVE = 10
+
+
+class TokenBucket():
+    """
+        Token bucket limiter. Tokens are refilled at rate per second up to capacity,
+        and every request consumes one token, blocking until one is available
+
+        Params:
+        - rate: the number of requests permitted per second
+        - capacity: the maximum burst of requests (default rate)
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+            Blocks until a token is available, then consumes it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+buckets: Dict[Tuple[str, str], TokenBucket] = {}
+buckets_lock = threading.Lock()
+
+
+def get_bucket(chain: str, api_key: str, rate: float) -> TokenBucket:
+    '''
+        Returns the TokenBucket shared by every scanner of a chain using the same API key,
+        creating it with the passed rate if it does not exist yet. Each *Scan API has its
+        own quota, so scanners of different chains (including keyless ones) never share one
+    '''
+    key = (chain, api_key)
+
+    with buckets_lock:
+        if key not in buckets:
+            buckets[key] = TokenBucket(rate)
+
+        return buckets[key]
+
+
+class ScanScheduler():
+    """
+        Runs scheduled lookups on a pool of worker threads, ordered by priority and
+        then by submission order. Lookups that have not started yet can be cancelled
+        through their Future, which is used to promote them to a higher priority
+
+        Params:
+        - workers: the number of worker threads to run lookups on (default 4)
+    """
+
+    def __init__(self, workers: int = 4) -> None:
+        self.workers = workers
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+
+        self.threads = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __start(self) -> None:
+        """
+            Starts the worker threads on the first submitted lookup
+        """
+        with self.lock:
+            if len(self.threads) > 0:
+                return
+
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self.__work, daemon=True)
+                thread.start()
+
+                self.threads.append(thread)
+
+    def __work(self) -> None:
+        self.local.worker = True
+
+        while True:
+            _, _, future, fn, args = self.queue.get()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, fn: Callable, *args, priority: Priority = Priority.NORMAL) -> Future:
+        '''
+            Schedules fn(*args) to run on a worker thread
+
+            @param fn : the function to run
+            @param priority : the priority of the lookup (default Priority.NORMAL)
+
+            @returns a Future that resolves to the result of fn
+        '''
+        future = Future()
+        future.call = (fn, args)
+
+        self.queue.put((int(priority), next(self.counter), future, fn, args))
+        self.__start()
+
+        return future
+
+    def wait(self, future: Future) -> Any:
+        '''
+            Returns the result of a submitted lookup. Called from one of the worker threads, a
+            lookup that has not started yet is run on the calling thread instead, so a lookup
+            waiting on other lookups cannot block every worker on tasks that are still queued
+
+            @param future : a Future returned by submit
+
+            @returns the result of the lookup
+        '''
+        if getattr(self.local, "worker", False) and future.cancel():
+            fn, args = future.call
+
+            return fn(*args)
+
+        return future.result()
@@ -0,0 +1,234 @@
+"""
+    Defines a local database of known function selectors and event topics, mapped back to
+    their text signatures, so that calls and events of contracts that are not verified on
+    *Scan can still be decoded without any network access
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import threading
+from typing import Iterable, List
+
+from contractcache import ContractCache, CONTRACTCACHE
+from signatures import registry
+
+SIGNATUREDB = "./signaturedb"
+
+# the text signatures shipped with the analysis, one per line
+BUNDLED_SIGNATURES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "signatures.txt")
+
+MAGIC = b"SIGDB1"
+HEADER = struct.Struct(">6sBI")
+OFFSET = struct.Struct(">I")
+
+
+class SignatureTable():
+    """
+        Memory-mapped, sorted table of hash -> text signature, stored as a header followed by
+        count fixed width records of (hash, offset of the signature), then the newline
+        terminated signatures. Lookups are binary searches over the mapped records, so the
+        table is never read into memory as a whole
+
+        Params:
+        - filepath: the path of the table file
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+
+        with open(filepath, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.key_size, self.count = HEADER.unpack_from(self.map, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f"{filepath} is not a signature table")
+
+        self.record_size = self.key_size + OFFSET.size
+        self.blob = HEADER.size + self.count * self.record_size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __key(self, i: int) -> bytes:
+        start = HEADER.size + i * self.record_size
+        return self.map[start:start + self.key_size]
+
+    def __signature(self, i: int) -> str:
+        start = self.blob + OFFSET.unpack_from(
+            self.map, HEADER.size + i * self.record_size + self.key_size)[0]
+
+        return self.map[start:self.map.find(b"\n", start)].decode()
+
+    def get(self, key: bytes) -> List[str]:
+        '''
+            Returns every text signature whose hash is key, as selectors can collide
+        '''
+        lo, hi = 0, self.count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self.__key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        res = []
+
+        while lo < self.count and self.__key(lo) == key:
+            res.append(self.__signature(lo))
+            lo += 1
+
+        return res
+
+    def close(self) -> None:
+        self.map.close()
+
+    @staticmethod
+    def write(filepath: str, entries: Iterable[tuple]) -> None:
+        '''
+            Writes a table of (hash, text signature) entries to filepath
+        '''
+        entries = sorted(set(entries))
+        key_size = len(entries[0][0]) if len(entries) > 0 else 0
+
+        records = bytearray()
+        blob = bytearray()
+
+        for key, signature in entries:
+            records += key + OFFSET.pack(len(blob))
+            blob += signature.encode() + b"\n"
+
+        tmp = f"{filepath}.tmp"
+
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, key_size, len(entries)))
+            f.write(records)
+            f.write(blob)
+
+        os.replace(tmp, filepath)
+
+
+class SignatureDB():
+    """
+        Database of 4-byte function selectors and 32 byte event topics, stored in the
+        {directory}/selectors.sigdb and {directory}/topics.sigdb tables. The tables are
+        built from the bundled signatures.txt the first time the directory is used, and
+        can be extended with build() or the __main__ script
+
+        Params:
+        - directory: the directory of the tables (default ./signaturedb)
+    """
+
+    def __init__(self, directory: str = SIGNATUREDB) -> None:
+        self.directory = directory
+
+        if not os.path.exists(os.path.join(directory, "selectors.sigdb")):
+            build(directory, [])
+
+        self.selectors = SignatureTable(
+            os.path.join(directory, "selectors.sigdb"))
+        self.topics = SignatureTable(os.path.join(directory, "topics.sigdb"))
+
+    def get_functions(self, selector: str) -> List[str]:
+        '''
+            Returns the known text signatures of a function selector
+
+            @param selector : the hex selector, without 0x
+        '''
+        if len(selector) != 8:
+            return []
+
+        return self.selectors.get(bytes.fromhex(selector))
+
+    def get_events(self, topic: str) -> List[str]:
+        '''
+            Returns the known text signatures of an event topic
+
+            @param topic : the hex topic0 of the event, without 0x
+        '''
+        if len(topic) != 64:
+            return []
+
+        return self.topics.get(bytes.fromhex(topic))
+
+    def has_function(self, selector: str) -> bool:
+        return len(self.get_functions(selector)) > 0
+
+    def close(self) -> None:
+        self.selectors.close()
+        self.topics.close()
+
+
+def read_signatures(filepath: str) -> List[str]:
+    '''
+        Reads a text file of signatures, one per line, ignoring blank lines and whitespace
+    '''
+    with open(filepath, "r") as f:
+        return [i.strip().replace(" ", "") for i in f if i.strip() != ""]
+
+
+def build(directory: str, signatures: Iterable[str]) -> None:
+    '''
+        Builds the selector and topic tables of a directory from the bundled signatures
+        and the passed text signatures. As a text signature does not say whether it is a
+        function or an event, every signature is added to both tables
+
+        @param directory : the directory to write the tables to
+        @param signatures : the text signatures to add to the bundled ones
+    '''
+    signatures = set(read_signatures(BUNDLED_SIGNATURES)) | set(signatures)
+    hashes = [(bytes.fromhex(registry.get_hash(i)), i) for i in signatures]
+
+    os.makedirs(directory, exist_ok=True)
+
+    SignatureTable.write(os.path.join(directory, "selectors.sigdb"),
+                         ((h[:4], i) for h, i in hashes))
+    SignatureTable.write(os.path.join(
+        directory, "topics.sigdb"), iter(hashes))
+
+
+signature_db: SignatureDB = None
+signature_db_lock = threading.Lock()
+
+
+def get_signature_db(directory: str = SIGNATUREDB) -> SignatureDB:
+    '''
+        Returns the process-wide SignatureDB, opening it on first use
+    '''
+    global signature_db
+
+    with signature_db_lock:
+        if signature_db is None:
+            signature_db = SignatureDB(directory)
+
+        return signature_db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Builds the local signature database from the bundled signatures and extra sources")
+    parser.add_argument('-d', '--directory', type=str, default=SIGNATUREDB,
+                        help="The directory of the signature database, default ./signaturedb")
+    parser.add_argument('-f', '--files', type=str, nargs="*", default=[],
+                        help="Text files of signatures to add, one per line, such as transfer(address,uint256)")
+    parser.add_argument('-cc', '--contractCache', type=str, default=None,
+                        help=f"A contract cache (such as {CONTRACTCACHE}) whose hashed signatures are added")
+
+    args = parser.parse_args()
+
+    signatures = []
+
+    for filepath in args.files:
+        signatures.extend(read_signatures(filepath))
+
+    if args.contractCache is not None:
+        cache = ContractCache(args.contractCache)
+        signatures.extend(i for i, _ in cache.get_signatures())
+        cache.close()
+
+    build(args.directory, signatures)
@@ -0,0 +1,121 @@
+"""
+    Defines a process-wide registry of keccak256 hashes of canonical function and event
+    signatures, so that signatures shared by many contracts are only hashed once
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from Crypto.Hash import keccak
+
+from contractcache import ContractCache
+
+
+def get_canonical_type(param: Dict[str, object]) -> str:
+    '''
+        Returns the canonical type of an ABI parameter, expanding tuples (structs)
+        into their component types, such as (address,uint256)[] for tuple[]
+    '''
+    _type = param['type']
+
+    if _type.startswith("tuple"):
+        components = ",".join(get_canonical_type(i)
+                              for i in param['components'])
+
+        return f"({components}){_type[5:]}"
+
+    return _type
+
+
+def get_canonical_signature(name: str, params: List[Dict[str, object]]) -> str:
+    '''
+        Returns the canonical signature of a function or event, such as
+        transfer(address,uint256), from its name and ABI inputs
+    '''
+    return f"{name}({','.join(get_canonical_type(i) for i in params)})"
+
+
+class SignatureRegistry():
+    """
+        Bounded LRU mapping between canonical signatures and the hex keccak256 hash of
+        the signature. Shared by every Contract through the module level registry, and
+        optionally persisted in the signatures table of a ContractCache
+
+        Params:
+        - maxsize: the maximum number of signatures to keep (default 65536)
+    """
+
+    def __init__(self, maxsize: int = 65536) -> None:
+        self.maxsize = maxsize
+
+        self.hashes: OrderedDict[str, str] = OrderedDict()
+        self.added: Dict[str, str] = {}
+
+        self.cache: ContractCache = None
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def get_hash(self, signature: str) -> str:
+        '''
+            Returns the hex keccak256 hash of a canonical signature, which is the topic of an
+            event signature, or the selector of a function signature in its first 8 characters
+
+            @param signature : the canonical signature, such as Transfer(address,address,uint256)
+        '''
+        with self.lock:
+            if signature in self.hashes:
+                self.hashes.move_to_end(signature)
+
+                return self.hashes[signature]
+
+        k = keccak.new(digest_bits=256)
+        k.update(str.encode(signature))
+
+        digest = k.hexdigest()
+
+        with self.lock:
+            self.hashes[signature] = digest
+
+            if self.cache is not None:
+                self.added[signature] = digest
+
+            if len(self.hashes) > self.maxsize:
+                self.hashes.popitem(last=False)
+
+        return digest
+
+    def get_selector(self, signature: str) -> str:
+        '''
+            Returns the 4-byte hex function selector of a canonical signature
+        '''
+        return self.get_hash(signature)[0:8]
+
+    def attach(self, cache: ContractCache) -> None:
+        '''
+            Loads the signatures persisted in a ContractCache, and persists signatures
+            hashed from now on into it on save()
+        '''
+        self.cache = cache
+
+        with self.lock:
+            for signature, digest in cache.get_signatures(self.maxsize):
+                self.hashes.setdefault(signature, digest)
+
+    def save(self) -> None:
+        '''
+            Writes the signatures hashed since attach() to the attached ContractCache
+        '''
+        if self.cache is None:
+            return
+
+        with self.lock:
+            added = self.added
+            self.added = {}
+
+        self.cache.put_signatures(added.items())
+
+
+registry = SignatureRegistry()
@@ -0,0 +1,81 @@
+import pytest
+
+from abidecoder import compile_type, decode_args, decode_event, decode_event_signature, decode_signature, name_values
+from errors import DecodeError, TypeNotFound
+
+
+def word(value) -> bytes:
+    if isinstance(value, bytes):
+        return value.ljust(32, b"\0")
+
+    return value.to_bytes(32, "big", signed=value < 0)
+
+
+ADDRESS = "0x" + "ab" * 20
+
+
+def test_decode_static_args_keeps_uint256_precision():
+    data = word(int(ADDRESS, 16)) + word(2 ** 256 - 1) + word(1)
+
+    assert list(decode_args([{'type': 'address'}, {'type': 'uint256'}, {'type': 'bool'}], data)) == [
+        ADDRESS, 2 ** 256 - 1, True]
+
+
+def test_decode_signed_int():
+    assert compile_type("int256").decode(word(-5), 0) == -5
+
+
+def test_decode_dynamic_args():
+    # (string, uint256[], bytes32): head of offset / offset / value, then the tails
+    data = (word(96) + word(160) + word(b"\x01")
+            + word(3) + word(b"abc")
+            + word(2) + word(7) + word(8))
+
+    assert list(decode_args([{'type': 'string'}, {'type': 'uint256[]'}, {'type': 'bytes32'}], data)) == [
+        "abc", [7, 8], b"\x01".ljust(32, b"\0")]
+
+
+def test_decode_tuple_component():
+    params = [{'type': 'tuple', 'components': [{'type': 'address'}, {'type': 'uint256'}]}, {'type': 'uint8'}]
+
+    assert list(decode_args(params, word(int(ADDRESS, 16)) + word(3) + word(4))) == [(ADDRESS, 3), 4]
+
+
+def test_decode_truncated_data_raises():
+    with pytest.raises(DecodeError):
+        decode_args([{'type': 'uint256'}, {'type': 'uint256'}], word(1))
+
+
+def test_compile_unknown_type_raises():
+    with pytest.raises(TypeNotFound):
+        compile_type("fixed128x18")
+
+
+def test_decode_event_indexed_and_hashed_topics():
+    params = [{'type': 'address', 'indexed': True}, {'type': 'string', 'indexed': True},
+              {'type': 'uint256', 'indexed': False}]
+    topics = [word(b"\x00"), word(int(ADDRESS, 16)), word(b"\x99")]
+
+    assert decode_event(params, topics, word(10)) == [ADDRESS, word(b"\x99"), 10]
+
+
+def test_decode_event_missing_topics_raises():
+    with pytest.raises(DecodeError):
+        decode_event([{'type': 'address', 'indexed': True}], [word(b"\x00")], b"")
+
+
+def test_decode_signatures():
+    assert list(decode_signature("transfer(address,uint256)", word(int(ADDRESS, 16)) + word(5))) == [ADDRESS, 5]
+
+    # the first len(topics) - 1 arguments are taken as indexed
+    assert decode_event_signature("Transfer(address,address,uint256)",
+                                  [word(b"\x00"), word(1), word(2)], word(5)) == [
+        "0x" + "00" * 19 + "01", "0x" + "00" * 19 + "02", 5]
+
+
+def test_name_values_matches_names_ignoring_underscores():
+    params = [{'name': '_receiver'}, {'name': 'amount'}]
+
+    assert name_values(params, ["0xr", 5]) == {'_receiver': "0xr", 'amount': 5}
+    assert name_values(params, ["0xr", 5], ["Amount", "receiver"]) == {'Amount': 5, 'receiver': "0xr"}
+    assert name_values(params, ["0xr", 5], ["to", "value"]) == {'to': "0xr", 'value': 5}
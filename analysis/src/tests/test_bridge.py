@@ -0,0 +1,132 @@
+import pandas as pd
+
+from bridge import Bridge, Chains, LINKED_COLUMNS, UNTIMED_ATTEMPTS
+from linker import IncrementalLinker
+
+
+class FakeEndpoint():
+    def __init__(self, src_rows=(), dest_rows=()) -> None:
+        self.src_rows = list(src_rows)
+        self.dest_rows = list(dest_rows)
+
+    def get_src_rows(self):
+        return self.src_rows
+
+    def get_dest_rows(self):
+        return self.dest_rows
+
+
+def send(_hash, value, transfer_id=None, receiver="0xr"):
+    return {'srcHash': _hash, 'srcSender': "0xs", 'srcReceiver': "0xe", 'srcTokenAddr': "0xt", 'srcChainId': 1,
+            'srcValue': value, 'destChainId': 56, 'destReceiver': receiver, 'transferId': transfer_id, 'srcBlock': 10}
+
+
+def relay(_hash, value, transfer_id=None, receiver="0xr"):
+    return {'destHash': _hash, 'destSender': "0xe", 'destReceiver': receiver, 'destTokenAddr': "0xu", 'destChainId': 56,
+            'destValue': value, 'transferId': transfer_id, 'destBlock': 20}
+
+
+def make_bridge(src_rows=(), dest_rows=()) -> Bridge:
+    bridge = Bridge("test", {}, {}, {}, [])
+    bridge.bridges = {1: FakeEndpoint(src_rows=src_rows),
+                      56: FakeEndpoint(dest_rows=dest_rows)}
+
+    # source blocks are taken as aligned with the destination blocks
+    bridge.get_relative_chain_block = lambda block, src_chain, dest_chain: block
+
+    return bridge
+
+
+def test_find_invalid_transfer_amt_compares_uint256_exactly():
+    bridge = make_bridge()
+    bridge.linked_tx = pd.DataFrame([{**send("a", 10**21), **relay("x", 10**21 + 10**4)},
+                                     {**send("b", 10**21), **relay("y", 10**21)}],
+                                    columns=LINKED_COLUMNS, dtype=object)
+
+    bridge.find_invalid_transfer_amt()
+
+    assert list(bridge.linked_tx['srcHash']) == ["b"]
+    assert list(bridge.invalid_tx['srcHash']) == ["a"]
+    assert list(bridge.invalid_tx['reason']) == ["amount"]
+
+
+def test_find_invalid_transfer_amt_drops_unlinked_rows():
+    bridge = make_bridge()
+    bridge.linked_tx = pd.DataFrame([send("a", 5), relay("x", 5), {**send("b", 5), **relay("y", 5)}],
+                                    columns=LINKED_COLUMNS, dtype=object)
+
+    bridge.find_invalid_transfer_amt()
+
+    assert list(bridge.linked_tx['srcHash']) == ["b"]
+    assert len(bridge.invalid_tx) == 0
+
+
+def test_link_transactions_drops_unmatched_rows():
+    bridge = make_bridge([send("a", 5, "0x1"), send("b", 5, "0x2"), send("c", 5)],
+                         [relay("x", 5, "0x1"), relay("y", 5, "0x9", receiver="0xq"), relay("z", 5)])
+
+    bridge.link_transactions()
+
+    # b has no relay with its id, and y is claimed by no send
+    assert bridge.linked_tx[['srcHash', 'destHash']].values.tolist() == [["a", "x"], ["c", "z"]]
+
+
+def test_link_transactions_records_latency_of_valid_links_only():
+    bridge = make_bridge([send("a", 5, "0x1"), send("b", 5, "0x2")],
+                         [relay("x", 5, "0x1"), relay("y", 6, "0x2")])
+
+    bridge.link_transactions()
+
+    # the inflated relay y is not learned from
+    assert list(bridge.latency.delays[("test", 1, 56)]) == [10]
+
+
+class FakeStore():
+    def get_block_timestamp(self, block):
+        return None
+
+
+def test_link_incremental_gives_up_on_untimed_sends():
+    bridge = make_bridge([send("a", 5, "0x1")])
+    bridge.linker = IncrementalLinker()
+    bridge.bridges[1].store = FakeStore()
+
+    expired = []
+
+    for _ in range(UNTIMED_ATTEMPTS):
+        expired.extend(bridge.link_incremental())
+        bridge.bridges[1].src_rows = []
+
+    assert [i['srcHash'] for i in expired] == ["a"]
+    assert bridge.untimed == []
+
+
+class BlockStore():
+    def __init__(self, timestamps) -> None:
+        self.timestamps = timestamps
+        self.lookups = 0
+
+    def get_block_timestamp(self, block):
+        return self.timestamps.get(block)
+
+    def get_closest_block(self, timestamp):
+        self.lookups += 1
+
+        return None if timestamp > 1000 else timestamp // 3
+
+
+def test_get_relative_chain_block_does_not_memoize_unknown_blocks():
+    bridge = Bridge("test", {}, {}, {}, [])
+    bridge.bridges = {Chains.ETH: FakeEndpoint(), Chains.POLYGON: FakeEndpoint()}
+    bridge.bridges[Chains.ETH].store = BlockStore({1: 120, 2: 5000})
+    bridge.bridges[Chains.POLYGON].store = dest = BlockStore({})
+
+    assert bridge.get_relative_chain_block(1, Chains.ETH, Chains.POLYGON) == 40
+    assert bridge.get_relative_chain_block(1, Chains.ETH, Chains.POLYGON) == 40
+    assert dest.lookups == 1
+
+    assert bridge.get_relative_chain_block(2, Chains.ETH, Chains.POLYGON) is None
+    assert bridge.get_relative_chain_block(2, Chains.ETH, Chains.POLYGON) is None
+    assert dest.lookups == 3
+
+    assert bridge.get_relative_chain_block(3, Chains.ETH, Chains.POLYGON) is None
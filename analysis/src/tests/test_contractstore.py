@@ -0,0 +1,21 @@
+from contractcache import ContractCache
+from contractstore import ContractStore
+
+
+class Scanner():
+    chain = "eth"
+
+
+def test_is_unverified_only_for_known_unverified_contracts():
+    cache = ContractCache(":memory:")
+    cache.put("eth", "0xa", {})
+    cache.put("eth", "0xb", {"SourceCode": "", "ABI": "[]",
+              "ContractName": "B", "ConstructorArguments": ""})
+
+    store = ContractStore(Scanner(), cache)
+    store.contracts["0xd"] = None
+
+    assert store.is_unverified("0xa")
+    assert not store.is_unverified("0xb")
+    assert not store.is_unverified("0xc")
+    assert store.is_unverified("0xd")
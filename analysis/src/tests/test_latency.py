@@ -0,0 +1,37 @@
+from latency import LatencyProfile
+
+
+def test_windows_without_enough_delays_start_at_default_range():
+    profile = LatencyProfile()
+
+    assert profile.get_windows("celer", 1, 56) == [100, 200, 400, 800, 1600]
+
+
+def test_windows_follow_the_percentiles_of_the_route():
+    profile = LatencyProfile()
+
+    for delay in [3, 4, 5, 6, 4, 5, 7, 8, 30, 4, 5, 6]:
+        profile.record("celer", 1, 56, delay)
+
+    assert profile.get_percentile("celer", 1, 56, 50) == 5
+    assert profile.get_windows("celer", 1, 56)[:4] == [8, 12, 45, 60]
+    assert profile.get_windows("celer", 1, 56)[-1] == 1600
+
+
+def test_delays_are_kept_per_route_up_to_maxlen(tmp_path):
+    filepath = str(tmp_path / "latency.db")
+
+    profile = LatencyProfile(filepath, maxlen=3)
+
+    for delay in range(10):
+        profile.record("celer", 1, 56, delay)
+
+    profile.record("celer", 56, 1, 1)
+    profile.close()
+
+    profile = LatencyProfile(filepath, maxlen=3)
+
+    assert list(profile.delays[("celer", 1, 56)]) == [7, 8, 9]
+    assert list(profile.delays[("celer", 56, 1)]) == [1]
+    assert profile.conn.execute("SELECT COUNT(*) FROM delays").fetchone()[0] == 4
+    profile.close()
@@ -0,0 +1,118 @@
+from linker import IncrementalLinker, link_asof
+
+
+def send(_hash, transfer_id=None, receiver="0xr"):
+    return {'srcHash': _hash, 'srcValue': 5, 'destChainId': 56, 'destReceiver': receiver, 'transferId': transfer_id}
+
+
+def relay(_hash, transfer_id=None, receiver="0xr"):
+    return {'destHash': _hash, 'destValue': 5, 'destChainId': 56, 'destReceiver': receiver, 'transferId': transfer_id}
+
+
+def test_asof_links_first_relay_within_tolerance():
+    sends = [{**send("a"), 'srcTimestamp': 100}]
+    relays = [{**relay("x"), 'destTimestamp': 90},
+              {**relay("y"), 'destTimestamp': 150},
+              {**relay("z"), 'destTimestamp': 160}]
+
+    linked = link_asof(sends, relays, 60)
+
+    assert [(row['srcHash'], row.get('destHash')) for row in linked] == [("a", "y")]
+
+
+def test_asof_keeps_send_past_tolerance_unlinked():
+    linked = link_asof([{**send("a"), 'srcTimestamp': 100}],
+                       [{**relay("x"), 'destTimestamp': 200}], 60)
+
+    assert linked == [{**send("a"), 'srcTimestamp': 100}]
+
+
+def test_asof_claims_each_relay_once_in_time_order():
+    sends = [{**send("b"), 'srcTimestamp': 105}, {**send("a"), 'srcTimestamp': 100},
+             {**send("c", receiver="0xq"), 'srcTimestamp': 100}]
+    relays = [{**relay("y"), 'destTimestamp': 120}, {**relay("x"), 'destTimestamp': 110}]
+
+    linked = {row['srcHash']: row.get('destHash') for row in link_asof(sends, relays, 60)}
+
+    assert linked == {"a": "x", "b": "y", "c": None}
+
+
+def test_asof_links_transfer_id_before_time():
+    sends = [{**send("a", "0x1"), 'srcTimestamp': 100}, {**send("b", "0x2"), 'srcTimestamp': 100}]
+    relays = [{**relay("x"), 'destTimestamp': 101},
+              {**relay("y", "0x1"), 'destTimestamp': 5000}]
+
+    linked = {row['srcHash']: row.get('destHash') for row in link_asof(sends, relays, 60)}
+
+    # the id of b has no relay, so it is not linked to x by time
+    assert linked == {"a": "y", "b": None}
+
+
+def test_incremental_links_either_order():
+    linker = IncrementalLinker()
+
+    assert linker.add_send(send("a", "0x1"), 100, "celer") is None
+    assert linker.add_relay(relay("x", "0x1"), 110, "celer")['srcHash'] == "a"
+
+    assert linker.add_relay(relay("y", "0x2"), 120, "celer") is None
+    assert linker.add_send(send("b", "0x2"), 130, "celer")['destHash'] == "y"
+
+    assert len(linker) == 0
+
+
+def test_incremental_keys_on_transfer_id_alone():
+    linker = IncrementalLinker()
+
+    linker.add_send(send("a", "0x1", receiver="0xr"), 100, "celer")
+
+    # the receiver of the relay row comes from another token transfer of the relay
+    assert linker.add_relay(relay("x", "0x1", receiver="0xq"), 110, "celer")['srcHash'] == "a"
+
+
+def test_incremental_matches_without_id_first_in_first_out():
+    linker = IncrementalLinker()
+
+    linker.add_send(send("a"), 100, "celer")
+    linker.add_send(send("b"), 101, "celer")
+
+    assert linker.add_relay(relay("x"), 110, "celer")['srcHash'] == "a"
+    assert linker.add_relay(relay("y"), 111, "celer")['srcHash'] == "b"
+
+
+def test_incremental_ignores_seen_transactions():
+    linker = IncrementalLinker()
+
+    linker.add_send(send("a", "0x1"), 100, "celer")
+    linker.add_relay(relay("x", "0x1"), 110, "celer")
+
+    assert linker.has_seen("celer", "x")
+    assert linker.add_relay(relay("x", "0x1"), 110, "celer") is None
+    assert len(linker) == 0
+
+
+def test_incremental_keeps_bridges_apart():
+    linker = IncrementalLinker(ttl=10)
+
+    linker.add_send(send("a", "0x1"), 100, "celer")
+    linker.add_send(send("b", "0x1"), 100, "other")
+
+    assert linker.add_relay(relay("x", "0x1"), 200, "other")['srcHash'] == "b"
+    assert linker.add_send(send("c"), 200, "celer") is None
+
+    # only the sends of the bridge are expired and returned
+    assert linker.expire("other") == []
+    assert [i['srcHash'] for i in linker.expire("celer")] == ["a"]
+
+
+def test_incremental_resumes_from_file(tmp_path):
+    filepath = str(tmp_path / "links.db")
+
+    linker = IncrementalLinker(filepath)
+    linker.add_send(send("a", "0x1"), 100, "celer")
+    linker.close()
+
+    linker = IncrementalLinker(filepath)
+
+    assert linker.has_seen("celer", "a")
+    assert linker.add_relay(relay("x", "0x1"), 110, "celer")['srcHash'] == "a"
+    linker.close()
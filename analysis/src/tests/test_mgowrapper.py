@@ -0,0 +1,70 @@
+from pymongo.errors import DuplicateKeyError
+
+from mgowrapper import MongoFetcher, get_block_range_query, to_checksum_address
+
+
+def test_to_checksum_address_matches_eip55():
+    assert to_checksum_address(
+        "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed") == "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
+    assert to_checksum_address(
+        "0xFB6916095CA1DF60BB79CE92CE3EA74C37C5D359") == "0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359"
+
+
+class Collection():
+    def __init__(self, docs=None) -> None:
+        self.queries = []
+        self.indexes = []
+        self.docs = docs or []
+
+    def find(self, query, projection, limit=0, batch_size=100):
+        self.queries.append(query)
+        return []
+
+    def create_index(self, keys, unique=False, name=None):
+        txs = [doc['tx'] for doc in self.docs]
+
+        if unique and len(set(txs)) < len(txs):
+            raise DuplicateKeyError("E11000 duplicate key error", 11000)
+
+        self.indexes.append(name)
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        txs = [doc['tx'] for doc in self.docs]
+        return [{"_id": tx, "n": txs.count(tx)} for tx in dict.fromkeys(txs) if txs.count(tx) > 1]
+
+
+def test_get_block_range_matches_checksummed_to():
+    fetcher = object.__new__(MongoFetcher)
+    fetcher.collection = Collection()
+
+    fetcher.get_block_range(1, 2, "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed")
+
+    assert fetcher.collection.queries[0]["to"] == {"$in": ["0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed",
+                                                           "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed"]}
+
+
+def test_get_block_range_uses_the_block_range_query():
+    fetcher = object.__new__(MongoFetcher)
+    fetcher.collection = Collection()
+
+    fetcher.get_block_range(1, 2, "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed", selectors=["a9059cbb"])
+
+    assert fetcher.collection.queries[0] == get_block_range_query(
+        1, 2, "0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed", ["a9059cbb"])
+    assert "functrace" in fetcher.collection.queries[0]
+
+
+def test_ensure_indexes_reports_duplicate_txs():
+    fetcher = object.__new__(MongoFetcher)
+    fetcher.collection = Collection([{"tx": "0x1"}, {"tx": "0x2"}, {"tx": "0x1"}])
+
+    assert fetcher.ensure_indexes() == ["0x1"]
+    assert fetcher.collection.indexes == ["block_to_tx", "tx"]
+
+
+def test_ensure_indexes_creates_unique_tx_index():
+    fetcher = object.__new__(MongoFetcher)
+    fetcher.collection = Collection([{"tx": "0x1"}, {"tx": "0x2"}])
+
+    assert fetcher.ensure_indexes() == []
+    assert fetcher.collection.indexes == ["block_to_tx", "tx_unique"]
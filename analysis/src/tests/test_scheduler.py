@@ -0,0 +1,23 @@
+from scheduler import ScanScheduler, get_bucket
+
+
+def test_wait_from_worker_runs_queued_lookup_inline():
+    scheduler = ScanScheduler(workers=1)
+
+    def outer():
+        return scheduler.wait(scheduler.submit(lambda: 1)) + 1
+
+    # with a single worker, waiting on the queued inner lookup would never return
+    assert scheduler.submit(outer).result(timeout=5) == 2
+
+
+def test_wait_outside_workers_returns_result():
+    scheduler = ScanScheduler(workers=2)
+
+    assert scheduler.wait(scheduler.submit(sum, [1, 2])) == 3
+
+
+def test_buckets_are_keyed_by_chain_and_api_key():
+    assert get_bucket("eth", None, 5) is get_bucket("eth", None, 5)
+    assert get_bucket("eth", None, 5) is not get_bucket("bsc", None, 5)
+    assert get_bucket("eth", "a", 5) is not get_bucket("eth", "b", 5)
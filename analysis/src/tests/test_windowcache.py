@@ -0,0 +1,86 @@
+from windowcache import WindowCache
+
+
+class Candidate():
+    def __init__(self, block: int) -> None:
+        self.block = block
+
+
+class Fetcher():
+    """
+        Fetches one candidate every 10 blocks, recording the requested ranges. Ranges
+        ending after limit are reported as incomplete
+    """
+
+    def __init__(self, limit: int = None) -> None:
+        self.limit = limit
+        self.calls = []
+
+    def __call__(self, start: int, end: int):
+        self.calls.append((start, end))
+
+        return [Candidate(i) for i in range(start, end + 1) if i % 10 == 0], self.limit is None or end <= self.limit
+
+
+def blocks(candidates):
+    return [i.block for i in candidates]
+
+
+def test_get_fetches_only_uncovered_blocks():
+    cache = WindowCache()
+    fetch = Fetcher()
+
+    assert blocks(cache.get("k", 0, 50, fetch)) == [0, 10, 20, 30, 40, 50]
+    assert blocks(cache.get("k", 100, 150, fetch)) == [100, 110, 120, 130, 140, 150]
+    assert blocks(cache.get("k", 20, 180, fetch)) == list(range(20, 190, 10))
+
+    assert fetch.calls == [(0, 50), (100, 150), (51, 99), (151, 180)]
+
+
+def test_get_covered_range_does_not_fetch():
+    cache = WindowCache()
+    fetch = Fetcher()
+
+    cache.get("k", 0, 100, fetch)
+
+    assert blocks(cache.get("k", 25, 75, fetch)) == [30, 40, 50, 60, 70]
+    assert fetch.calls == [(0, 100)]
+
+
+def test_get_keys_are_separate():
+    cache = WindowCache()
+    fetch = Fetcher()
+
+    cache.get("a", 0, 50, fetch)
+    cache.get("b", 0, 50, fetch)
+
+    assert fetch.calls == [(0, 50), (0, 50)]
+
+
+def test_get_does_not_cache_incomplete_ranges():
+    cache = WindowCache()
+    fetch = Fetcher(limit=100)
+
+    cache.get("k", 50, 150, fetch)
+    cache.get("k", 50, 150, fetch)
+
+    assert fetch.calls == [(50, 150), (50, 150)]
+
+
+def test_budget_evicts_least_recently_used():
+    cache = WindowCache(budget=12)
+    fetch = Fetcher()
+
+    cache.get("k", 0, 50, fetch)
+    cache.get("k", 100, 150, fetch)
+
+    # the first range is used again, so the second one is evicted
+    cache.get("k", 0, 50, fetch)
+    cache.get("k", 200, 250, fetch)
+
+    assert len(cache) == 12
+
+    cache.get("k", 0, 50, fetch)
+    cache.get("k", 100, 150, fetch)
+
+    assert fetch.calls == [(0, 50), (100, 150), (200, 250), (100, 150)]
@@ -0,0 +1,210 @@
+"""
+    Columnar parsers for the functrace, eventtrace and transferlogs strings written by the
+    DBLogger. Each trace is parsed in one pass into column arrays, and the Call, TxEvent and
+    Transfer objects of a Transaction are views over a row of those columns
+"""
+
+import sys
+from typing import Iterator, List
+
+import numpy as np
+
+
+def split_rows(trace: str, fields: int) -> List[tuple]:
+    '''
+        Splits a trace string into its columns, transposing the rows in a single pass.
+        Rows are split on at most fields - 1 commas, rows missing trailing fields (such as
+        the type of older transferlogs) are padded with "", and empty traces return empty columns
+
+        @param trace : the raw trace string
+        @param fields : the number of fields of each row
+
+        @returns a list of fields tuples, one per column
+    '''
+    if trace == "" or trace is None:
+        return [()] * fields
+
+    rows = [i.split(",", fields - 1) for i in trace.split("\n") if i != ""]
+    rows = [i if len(i) == fields else i + [""] * (fields - len(i))
+            for i in rows]
+
+    if len(rows) == 0:
+        return [()] * fields
+
+    return list(zip(*rows))
+
+
+def to_address(address: str) -> str:
+    '''
+        The logger writes checksummed addresses, and the from / to of token transfers as the
+        32 byte topics they were logged in, so addresses are lowercased and trimmed to their
+        20 bytes to match the bridge input file and the keys of the ContractStore
+    '''
+    if len(address) == 66:
+        address = "0x" + address[-40:]
+
+    return sys.intern(address.lower())
+
+
+def to_addresses(column: tuple) -> np.ndarray:
+    '''
+        Converts a column of addresses with to_address. Addresses are interned, so the
+        many rows sharing an address share one string
+    '''
+    return np.array([to_address(i) for i in column], dtype=object)
+
+
+def to_bytes(column: tuple) -> np.ndarray:
+    '''
+        Converts a column of 0x prefixed hex strings into raw bytes, half the size of the hex
+    '''
+    return np.array([bytes.fromhex(i[2:]) for i in column], dtype=object)
+
+
+def parse_topics(topics: str) -> List[bytes]:
+    '''
+        Parses a DBLogger topic list, formatted [0x<topic0> 0x<topic1> ...], into 32 byte
+        values, converting the whole list from hex in a single call
+
+        @param topics : the raw topic list
+
+        @returns the topics as 32 byte values
+    '''
+    raw = bytes.fromhex(topics[1:-1].replace("0x", "").replace(" ", ""))
+
+    return [raw[i:i + 32] for i in range(0, len(raw), 32)]
+
+
+class Words():
+    """
+        Read-only sequence of the 32 byte words of raw calldata or event data, starting at
+        offset. Words are only decoded into ints when they are accessed
+
+        Params:
+        - data: the raw bytes
+        - offset: the byte offset of the first word, such as 4 to skip a function selector
+    """
+
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data: bytes, offset: int = 0) -> None:
+        self.data = data
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return max(0, (len(self.data) - self.offset + 31) // 32)
+
+    def __getitem__(self, i: int) -> int:
+        if i < 0:
+            i += len(self)
+
+        if i < 0 or i >= len(self):
+            raise IndexError("word index out of range")
+
+        start = self.offset + i * 32
+
+        return int.from_bytes(self.data[start:start + 32], "big")
+
+    def __iter__(self) -> Iterator[int]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, o) -> bool:
+        return list(self) == list(o)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class FuncTrace():
+    """
+        Columns of a functrace, whose rows are formatted:
+        index,calltype,depth,from,to,value,gas,input,output,callstack,traceaddr
+
+        The input and output calldata are kept as raw bytes
+
+        Params:
+        - functrace: the raw functrace string
+    """
+
+    def __init__(self, functrace: str) -> None:
+        index, calltype, depth, _from, to, value, gas, _input, output, callstack, traceaddr = split_rows(
+            functrace, 11)
+
+        self.index = np.array(index, dtype=np.int64)
+        self.calltype = np.array(calltype, dtype=object)
+        self.depth = np.array(depth, dtype=np.int16)
+        self._from = to_addresses(_from)
+        self.to = to_addresses(to)
+        self.value = np.array(value, dtype=object)
+        self.gas = np.array(gas, dtype=np.uint64)
+        self.input = to_bytes(_input)
+        self.selector = np.array([sys.intern(i[2:10])
+                                 for i in _input], dtype=object)
+        self.output = to_bytes(output)
+        self.callstack = np.array(callstack, dtype=object)
+        self.traceaddr = np.array(traceaddr, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class EventTrace():
+    """
+        Columns of an eventtrace, whose rows are formatted:
+        address,[topic0 topic1 ...],data,type,function,traceindex
+
+        Topics are parsed into 32 byte values, with topic0 also kept as a hex string (without
+        the 0x prefix) to match Event.signature
+
+        Params:
+        - eventtrace: the raw eventtrace string
+    """
+
+    def __init__(self, eventtrace: str) -> None:
+        address, topics, data, _type, function, traceindex = split_rows(
+            eventtrace, 6)
+
+        self.address = to_addresses(address)
+        self.topics = np.empty(len(topics), dtype=object)
+        self.topics[:] = [parse_topics(i) for i in topics]
+        self.topic0 = np.array([sys.intern(i[0].hex()) if len(i) > 0 else ""
+                                for i in self.topics], dtype=object)
+        self.data = to_bytes(data)
+        self.type = np.array(_type, dtype=object)
+        self.function = np.array(function, dtype=object)
+        self.traceindex = np.array(traceindex, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.address)
+
+
+class TransferTrace():
+    """
+        Columns of the transferlogs, whose rows are formatted:
+        from,to,tokenAddr,value,calldepth,traceindex,callstack,type
+
+        The type is the token standard the logger matched the transfer event with (ERC20 or
+        ERC721), or ETH for native transfers. Rows written before the logger recorded it have
+        an empty type, which the Transaction fills by classifying the token contract
+
+        Params:
+        - transferlogs: the raw transferlogs string
+    """
+
+    def __init__(self, transferlogs: str) -> None:
+        _from, to, token, value, depth, traceindex, callstack, _type = split_rows(
+            transferlogs, 8)
+
+        self._from = to_addresses(_from)
+        self.to = to_addresses(to)
+        self.token = to_addresses(token)
+        self.value = np.array(value, dtype=object)
+        self.depth = np.array(depth, dtype=np.int16)
+        self.traceindex = np.array(traceindex, dtype=np.int64)
+        self.callstack = np.array(callstack, dtype=object)
+        self.type = np.array([sys.intern(i.strip())
+                             for i in _type], dtype=object)
+
+    def __len__(self) -> int:
+        return len(self._from)
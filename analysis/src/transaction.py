@@ -1,88 +1,183 @@
-from dataclasses import dataclass
-from mgowrapper import MongoFetcher
-from errors import MongoTxNotFound
+from mgowrapper import MongoFetcher, HEADER_FIELDS, TRACE_FIELDS
+from errors import MongoTxNotFound, DecodeError, TypeNotFound
 from contract import Contract, Event, Function
 from contractstore import ContractStore
-import ast
+from scheduler import Priority
+from traceparser import FuncTrace, EventTrace, TransferTrace, Words
+from signaturedb import get_signature_db
+from signatures import get_canonical_signature
+from abidecoder import decode_signature, decode_event_signature
 
-from typing import List, Dict, TUple
+from enum import Enum
+from typing import List, Dict, Tuple
+
+# the transfer types of token transfers, as opposed to native ETH transfers
+TOKEN_TYPES = frozenset(["ERC20", "ERC721"])
 
 
-@dataclass
 class Transfer():
     """
-        A single transfer event, corresponding to the transferLogs index in the database
+        A single transfer event, corresponding to the transferLogs index in the database.
+        A view over a row of the transaction's TransferTrace
     """
 
-    def __init__(self, _from: str, _to: str, token: str, amount: int, depth: int, _type):
-        self._from = _from
-        self._to = _to
-        self.token = token
-        self.amount = amount
-        self.depth = depth
-        self.type = _type
+    __slots__ = ("trace", "row")
+
+    def __init__(self, trace: TransferTrace, row: int):
+        self.trace = trace
+        self.row = row
+
+    @property
+    def _from(self) -> str:
+        return self.trace._from[self.row]
+
+    @property
+    def _to(self) -> str:
+        return self.trace.to[self.row]
+
+    @property
+    def token(self) -> str:
+        return self.trace.token[self.row]
+
+    @property
+    def amount(self) -> str:
+        return self.trace.value[self.row]
+
+    @property
+    def depth(self) -> int:
+        return int(self.trace.depth[self.row])
+
+    @property
+    def type(self) -> str:
+        return self.trace.type[self.row]
+
+    @type.setter
+    def type(self, _type: str) -> None:
+        self.trace.type[self.row] = _type
 
 
-@dataclass
 class TxEvent():
     """
-        Represents a logged event from the EVM. 
+        Represents a logged event from the EVM. A view over a row of the transaction's
+        EventTrace, with src_contract being the verified contract of the address, if any
     """
 
-    def __init__(self, src_contract: Contract, address: str, topics: List[str], data: str):
-        self.address = address
-        self.topics = topics
-        self.signature = topics[0]
+    __slots__ = ("contract", "trace", "row")
+
+    def __init__(self, src_contract: Contract, trace: EventTrace, row: int):
         self.contract = src_contract
-        self.data = self.__load_data(data)
+        self.trace = trace
+        self.row = row
+
+    @property
+    def address(self) -> str:
+        return self.trace.address[self.row]
+
+    @property
+    def topics(self) -> List[bytes]:
+        return self.trace.topics[self.row]
+
+    @property
+    def signature(self) -> str:
+        return self.trace.topic0[self.row]
 
-    def __load_data(self, data: List[str]):
-        lengths = self.contract.get_event_arg_lengths(self.topics[0])
-        counter = 0
-        res = []
+    @property
+    def data(self) -> Words:
+        """
+            The non-indexed data of the event, as 32 byte words decoded on access
+        """
+        return Words(self.trace.data[self.row])
 
-        for i in lengths:
-            res.append(int(self.data[counter: counter + i]), 16)
+    @property
+    def raw_data(self) -> bytes:
+        return self.trace.data[self.row]
 
-            counter += hex(i - 2)  # -2 to offset 0x prefix
+    @property
+    def traceindex(self) -> int:
+        return int(self.trace.traceindex[self.row])
 
-        return res
+    def decode(self, event: Event, names: List[str] = None) -> Dict[str, object]:
+        """
+            Decodes the topics and data of the event with the passed Event's ABI
+        """
+        return event.decode(self.topics, self.raw_data, names)
 
 
 class Call():
     """
-        A single call event. Either Call / CallCode / StaticCall / Create / DelegateCall
+        A single call event. Either Call / CallCode / StaticCall / Create / DelegateCall.
+        A view over a row of the transaction's FuncTrace
     """
 
-    def __init__(self, _hash: str, index: int, depth: int, calltype: str, _from: str, _to: str, value: int, gas: int, _input: str, output: str) -> None:
+    __slots__ = ("hash", "trace", "row", "event", "contract")
+
+    def __init__(self, _hash: str, trace: FuncTrace, row: int) -> None:
         self.hash = _hash
-        self.index = index
-        self._from = _from
-        self._to = _to
-        self.value = value
-        self.gas = gas
-
-        self.signature = ""
-        self.input: List[int] = self.__load_input(_input)
-        self.output = output
-        self.type = calltype
-        self.depth = depth
+        self.trace = trace
+        self.row = row
 
         self.event = None
 
         self.contract = None
 
-    def set_event(self, event: TxEvent):
-        self.event = event
+    @property
+    def index(self) -> int:
+        return int(self.trace.index[self.row])
+
+    @property
+    def depth(self) -> int:
+        return int(self.trace.depth[self.row])
+
+    @property
+    def type(self) -> str:
+        return self.trace.calltype[self.row]
+
+    @property
+    def _from(self) -> str:
+        return self.trace._from[self.row]
+
+    @property
+    def _to(self) -> str:
+        return self.trace.to[self.row]
+
+    @property
+    def value(self) -> int:
+        return int(self.trace.value[self.row])
+
+    @property
+    def gas(self) -> int:
+        return int(self.trace.gas[self.row])
+
+    @property
+    def signature(self) -> str:
+        return self.trace.selector[self.row]
+
+    @property
+    def input(self) -> Words:
+        """
+            The arguments of the call, as 32 byte words decoded on access
+        """
+        return Words(self.trace.input[self.row], 4)
+
+    @property
+    def calldata(self) -> bytes:
+        """
+            The raw calldata of the call, including the function selector
+        """
+        return self.trace.input[self.row]
 
-    def __load_input(self, _input):
-        res = []
+    @property
+    def output(self) -> str:
+        return "0x" + self.trace.output[self.row].hex()
 
-        self.signature = _input[2:10]
+    def decode(self, function: Function, names: List[str] = None) -> Dict[str, object]:
+        """
+            Decodes the calldata of the call with the passed Function's ABI
+        """
+        return function.decode_input(self.calldata, names)
 
-        [res.append(int(_input[i:i+64].lstrip('0'), 16))
-         for i in range(10, len(_input), 64)]
-        return res
+    def set_event(self, event: TxEvent):
+        self.event = event
 
     def set_contract(self, contract: Contract) -> None:
         self.contract = contract
@@ -97,10 +192,18 @@ class Call():
 class Transaction():
     """
         A single transaction object that stores metadata about a transaction, including
-        interacted contracts, inputs / outputs, etc
+        interacted contracts, inputs / outputs, etc.
+
+        With lazy set, only the header fields (to, from, value, gas, block) are fetched on
+        construction. The function, event and transfer traces are fetched and parsed the
+        first time calls, events, transfers, contracts, function_signatures or is_token_transfer
+        is accessed, and may_call can cheaply check a call target before that.
+
+        An already fetched document can be passed as data (such as from MongoFetcher.get_txs),
+        in which case the transaction is not fetched again
     """
 
-    def __init__(self, hash: str, fetcher: MongoFetcher, store: ContractStore) -> None:
+    def __init__(self, hash: str, fetcher: MongoFetcher, store: ContractStore, lazy: bool = False, data: dict = None) -> None:
         self.hash: str = hash
 
         self._to: str = ""
@@ -110,28 +213,73 @@ class Transaction():
         self.gas_used: int = 0
         self.block: int = 0
         self.store = store
+        self.fetcher = fetcher
+
+        self._function_signatures: Dict[str, List[str]] = {}
+
+        self._contracts: Dict[str, Contract] = {}
+        self._transfers: List[Transfer] = []
+        self._events: List[TxEvent] = []
+        self._calls: List[Call] = []
+
+        # built on first lookup, mapping (to, selector) and selector to their calls in trace order
+        self.calls_by_target: Dict[Tuple[str, str], List[Call]] = None
+        self.calls_by_selector: Dict[str, List[Call]] = None
 
-        self.function_signatures: Dict[str, List[str]] = {}
+        # built on first lookup, mapping (address, topic0) and topic0 to their events in trace order
+        self.events_by_address: Dict[Tuple[str, str], List[TxEvent]] = None
+        self.events_by_signature: Dict[str, List[TxEvent]] = None
 
-        self.contracts: Dict[str, Contract] = {}
-        self.transfers: List[Transfer] = []
-        self.events: List[TxEvent] = []
-        self.calls: List[Call] = []
+        self._is_token_transfer = False
 
-        self.is_token_transfer = False
+        self.traces_loaded = False
+        self.trace_data: dict = None
 
-        self.__load_tx(fetcher)
+        self.__load_tx(fetcher, lazy, data)
 
-    def __load_tx(self, fetcher: MongoFetcher) -> None:
+    @property
+    def function_signatures(self) -> Dict[str, List[str]]:
+        self.__ensure_traces()
+        return self._function_signatures
+
+    @property
+    def contracts(self) -> Dict[str, Contract]:
+        self.__ensure_traces()
+        return self._contracts
+
+    @property
+    def transfers(self) -> List[Transfer]:
+        self.__ensure_traces()
+        return self._transfers
+
+    @property
+    def events(self) -> List[TxEvent]:
+        self.__ensure_traces()
+        return self._events
+
+    @property
+    def calls(self) -> List[Call]:
+        self.__ensure_traces()
+        return self._calls
+
+    @property
+    def is_token_transfer(self) -> bool:
+        self.__ensure_traces()
+        return self._is_token_transfer
+
+    def __load_tx(self, fetcher: MongoFetcher, lazy: bool, data: dict = None) -> None:
         """
             Loads a transaction from the mongodb database if present. If not, a MongoTxNotFound
             error is risen. Ensure that the passed collection is correct. 
 
             Params:
             - fetcher: the MongoFetcher class instance to use to get the tx data
+            - lazy: whether to only fetch the header fields, deferring the traces
+            - data: the already fetched document of the transaction, if any
         """
 
-        data = fetcher.get_tx(self.hash)
+        if data is None:
+            data = fetcher.get_tx(self.hash, HEADER_FIELDS if lazy else None)
 
         if data == None:
             raise MongoTxNotFound(
@@ -144,39 +292,82 @@ class Transaction():
         self.gas_used = int(data['gasused'])
         self.block = int(data['block'])
 
-        self.__load_verified_functions(data['functrace'])
-        self.__load_transfer_logs(data['transferlogs'])
+        if 'functrace' in data:
+            self.trace_data = data
+
+        if not lazy:
+            self.__ensure_traces()
+
+    def __ensure_traces(self) -> None:
+        if not self.traces_loaded:
+            self.__load_traces(self.trace_data or self.fetcher.get_tx(
+                self.hash, TRACE_FIELDS))
+
+            self.trace_data = None
+
+    def __load_traces(self, data: dict) -> None:
+        """
+            Parses the function, transfer and event traces of a fetched transaction document
+        """
+        self.traces_loaded = True
+
+        transfers = TransferTrace(data['transferlogs'])
+
+        # the logger records the token standard of each transfer, so token contracts are only
+        # needed to classify rows written without it. Those are on the critical path for
+        # linking, so they are looked up first
+        untyped = {token for token, _type in zip(transfers.token, transfers.type)
+                   if _type == "" and token != ""}
+
+        self.store.prefetch(untyped, Priority.CRITICAL)
+
+        self.__load_verified_functions(data['functrace'], untyped)
+        self.__load_transfer_logs(transfers)
         self.__load_signatures()
-        self.__load_events(data['eventtrace'].split("\n"))
+        self.__load_events(data['eventtrace'])
 
-    def __load_verified_functions(self, functrace: str) -> None:
+    def may_call(self, address: str, sigs: List[str]) -> bool:
+        """
+            Returns whether the transaction calls one of the function signatures at the
+            passed address. If the traces are not loaded yet, the check is run against the
+            raw functrace within mongodb, so that only a boolean is transferred
+        """
+        if self.traces_loaded:
+            return any(self.contains_function(address, sig) for sig in sigs)
+
+        return self.fetcher.probe_calls(self.hash, address, sigs)
+
+    def __load_verified_functions(self, functrace: str, tokens: set) -> None:
         """
             Gets all verified contracts that the transaction interacted with in some way, traced
-            via the function logs. 
+            via the function logs. Call targets known to be unverified whose called functions
+            are all in the local signature database are decoded from it, so they are not looked
+            up again. tokens are the token contracts needed to classify untyped transfers
         """
 
-        addresses = set()
+        trace = FuncTrace(functrace)
 
-        for i in functrace.split("\n"):
-            index, calltype, depth, _from, _to, value, gas, _input, output, * \
-                _ = i.split(",")
+        self._calls = [Call(self.hash, trace, i) for i in range(len(trace))]
 
-            self.calls.append(Call(self.hash, int(index), int(
-                depth), calltype, _from, _to, int(value), int(gas), _input, output))
+        db = get_signature_db()
 
-            addresses.add(_from)
-            addresses.add(_to)
+        # whether every function called at an address is in the signature database
+        decodable = {}
 
-        for address in addresses:
-            contract = self.store.get_contract(address)
+        for to, selector in zip(trace.to, trace.selector):
+            decodable[to] = decodable.get(to, True) and (
+                selector == "" or db.has_function(selector))
 
-            if contract is not None:
-                self.contracts[contract.address] = contract
+        addresses = {address for address in set(trace._from) | set(trace.to)
+                     if not (decodable.get(address, False) and self.store.is_unverified(address))} | tokens
+
+        for contract in self.store.get_contracts(addresses).values():
+            self._contracts[contract.address] = contract
 
     def __str__(self) -> str:
         return (f"({self.block}) Transaction {self.hash}: {self._from}->{self._to}\n"
                 f"Value: {self.value}, Gas Price: {self.gas_price}, Gas Used: {self.gas_used}\n"
-                f"Contracts: \n{self.contracts}")
+                f"Contracts: \n{self._contracts}")
 
     def __repr__(self) -> str:
         return f"({self.block}) Transaction {self.hash}: {self._from}->{self._to}\n"
@@ -186,31 +377,66 @@ class Transaction():
             Loads all interacted with function signatures:
         """
 
-        for contract in self.contracts.values():
-            self.function_signatures.update(contract.get_func_signatures())
+        for contract in self._contracts.values():
+            self._function_signatures.update(contract.get_func_signatures())
 
-    def __load_events(self, logs: List[str]) -> None:
-        for event in logs:
-            addr, topics_str, data, _type, func, index, = event.split(',')
-            topics = ast.literal_eval(topics_str.replace(" ", ","))
+    def __load_events(self, logs: str) -> None:
+        """
+            Loads every logged event, attaching each to the call at its trace index
+        """
+        trace = EventTrace(logs)
 
-            contract = self.contracts.get(addr)
+        calls = dict(zip(self._calls[0].trace.index.tolist(), self._calls)) if len(
+            self._calls) > 0 else {}
 
-            if contract is not None:
-                self.calls[index].set_event(
-                    TxEvent(contract, addr, topics, data, _type))
+        for i in range(len(trace)):
+            event = TxEvent(self._contracts.get(trace.address[i]), trace, i)
 
-    def __load_transfer_logs(self, logs: List[str]) -> None:
-        for transfer in logs.split("\n"):
-            _from, _to, token_addr, amount, depth, *_ = transfer.split(",")
+            self._events.append(event)
 
-            if token_addr in self.contracts:
-                _type = self.contracts[token_addr].get_type()
-                self.is_token_transfer = True
-            else:
-                _type = ''
-            self.transfers.append(
-                Transfer(_from, _to, token_addr, amount, depth, _type))
+            if event.traceindex in calls:
+                calls[event.traceindex].set_event(event)
+
+    def __load_transfer_logs(self, trace: TransferTrace) -> None:
+        """
+            Loads every transfer, trusting the token standard recorded by the logger and only
+            classifying the token contract of rows written without one
+        """
+        for i in range(len(trace)):
+            transfer = Transfer(trace, i)
+
+            if transfer.type == "" and transfer.token in self._contracts:
+                transfer.type = self._contracts[transfer.token].get_type()
+
+            if transfer.type in TOKEN_TYPES:
+                self._is_token_transfer = True
+
+            self._transfers.append(transfer)
+
+    def __index_calls(self) -> None:
+        """
+            Indexes the calls by (to, selector) and by selector in a single pass over the trace
+        """
+        self.calls_by_target = {}
+        self.calls_by_selector = {}
+
+        for call in self.calls:
+            self.calls_by_target.setdefault(
+                (call._to, call.signature), []).append(call)
+            self.calls_by_selector.setdefault(call.signature, []).append(call)
+
+    def get_calls(self, address: str = None, sig: str = None) -> List[Call]:
+        """
+            Returns the calls of the transaction to a function signature, optionally only at the
+            passed address, in trace order. The lookup goes through indexes built on first use
+        """
+        if self.calls_by_target is None:
+            self.__index_calls()
+
+        if address is None:
+            return self.calls_by_selector.get(sig, [])
+
+        return self.calls_by_target.get((address, sig), [])
 
     def interacted_functions(self) -> List[str]:
         """
@@ -219,11 +445,10 @@ class Transaction():
             run after __load_verified_functions
         """
 
-        res = {}
-
-        for call in self.calls:
-            if call._to in self.function_signatures and call.input[2:10] in self.function_signatures[call._to]:
-                call.set_contract(self.store.get_contract(call._to))
+        for address, sigs in self.function_signatures.items():
+            for sig in sigs:
+                for call in self.get_calls(address, sig):
+                    call.set_contract(self.store.get_contract(address))
 
         return [i for i in self.calls if i.contract != None]
 
@@ -234,9 +459,7 @@ class Transaction():
         """
 
         if sig != None:
-            for call in self.calls:
-                if call._to == address and call.signature == sig:
-                    return True
+            return len(self.get_calls(address, sig)) > 0
 
         return False
 
@@ -247,8 +470,8 @@ class Transaction():
         """
 
         if sig != None:
-            for call in self.calls:
-                if len(call.input) > location and call._to == address and call.input[0][2:10] == sig and int(call.input[location].lstrip("0"), 16) == value:
+            for call in self.get_calls(address, sig):
+                if len(call.input) > location and call.input[location] == value:
                     return True
 
         return False
@@ -264,23 +487,147 @@ class Transaction():
         if sig is None:
             return self.calls[0].input[location]
 
-        for call in self.calls:
-            if call.signature == sig:
-                return call.input[location]
+        calls = self.get_calls(sig=sig)
+
+        if len(calls) > 0:
+            return calls[0].input[location]
 
         return -1
 
-    def get_event_data_value(self, address: str, event_sig: str, location: int) -> int:
+    def get_function_args(self, address: str, function: Function, names: List[str] = None) -> Dict[str, object] | None:
+        '''
+            Decodes the arguments of the first call to a function at the passed address
+
+            @param address : the address the function is called at
+            @param function : the Function to decode the call with
+            @param names : the field names to decode into (default the ABI parameter names)
+
+            @returns the decoded arguments, or None if the function is not called or the
+            calldata does not decode
+        '''
+        for call in self.get_calls(address, function.signature):
+            try:
+                return call.decode(function, names)
+            except (DecodeError, TypeNotFound):
+                continue
+
+        return None
+
+    def decode_call(self, call: Call) -> Tuple[str, Dict[str, object]] | None:
+        '''
+            Decodes a call with the ABI of its target if it is verified, else with the text
+            signatures of its selector in the local signature database. Arguments decoded from
+            a text signature are named by their position
+
+            @returns the text signature of the called function and its decoded arguments, or
+            None if the function is unknown or the calldata does not decode
+        '''
+        contract = self.contracts.get(call._to)
+
+        if contract is not None and call.signature in contract.functions_by_selector:
+            function = contract.functions_by_selector[call.signature]
+
+            try:
+                return get_canonical_signature(function.name, function.inputs), call.decode(function)
+            except (DecodeError, TypeNotFound):
+                return None
+
+        for signature in get_signature_db().get_functions(call.signature):
+            try:
+                values = decode_signature(signature, call.calldata[4:])
+            except (DecodeError, TypeNotFound):
+                continue
+
+            return signature, {str(i): v for i, v in enumerate(values)}
+
+        return None
+
+    def decode_event(self, event: TxEvent) -> Tuple[str, Dict[str, object]] | None:
+        '''
+            Decodes a logged event with the ABI of its emitter if it is verified, else with the
+            text signatures of its topic0 in the local signature database
+
+            @returns the text signature of the event and its decoded arguments, or None if the
+            event is unknown or does not decode
+        '''
+        contract = self.contracts.get(event.address)
+
+        if contract is not None and event.signature in contract.events_by_topic:
+            abi_event = contract.events_by_topic[event.signature]
+
+            try:
+                return get_canonical_signature(abi_event.name, abi_event.args), event.decode(abi_event)
+            except (DecodeError, TypeNotFound):
+                return None
+
+        for signature in get_signature_db().get_events(event.signature):
+            try:
+                values = decode_event_signature(
+                    signature, event.topics, event.raw_data)
+            except (DecodeError, TypeNotFound):
+                continue
+
+            return signature, {str(i): v for i, v in enumerate(values)}
+
+        return None
+
+    def __index_events(self) -> None:
+        """
+            Indexes the events by (address, topic0) and by topic0 in a single pass over the trace
+        """
+        self.events_by_address = {}
+        self.events_by_signature = {}
+
         for event in self.events:
-            if event.address == address and event_sig == event.signature:
-                return event.data[location]
+            self.events_by_address.setdefault(
+                (event.address, event.signature), []).append(event)
+            self.events_by_signature.setdefault(
+                event.signature, []).append(event)
+
+    def get_events(self, address: str = None, event_sig: str = None) -> List[TxEvent]:
+        """
+            Returns the events of the transaction with a signature (topic0), optionally only
+            those emitted by the passed address, in trace order
+        """
+        if self.events_by_address is None:
+            self.__index_events()
+
+        if address is None:
+            return self.events_by_signature.get(event_sig, [])
+
+        return self.events_by_address.get((address, event_sig), [])
+
+    def get_event_args(self, address: str, event: Event, names: List[str] = None) -> Dict[str, object] | None:
+        '''
+            Decodes the arguments of the first instance of an event emitted by the passed address
+
+            @param address : the address that emits the event
+            @param event : the Event to decode the logged event with
+            @param names : the field names to decode into (default the ABI parameter names)
+
+            @returns the decoded arguments, or None if the event is not emitted or does not decode
+        '''
+        for tx_event in self.get_events(address, event.signature):
+            try:
+                return tx_event.decode(event, names)
+            except (DecodeError, TypeNotFound):
+                continue
+
+        return None
+
+    def get_event_data_value(self, address: str, event_sig: str, location: int) -> int:
+        events = self.get_events(address, event_sig)
+
+        if len(events) > 0:
+            return events[0].data[location]
 
         return -1
 
     def get_event_data(self, address: str, event_sig: str) -> List[int]:
-        for event in self.events:
-            if event.address == address and event_sig == event.signature:
-                return event.data
+        events = self.get_events(address, event_sig)
+
+        if len(events) > 0:
+            return events[0].data
 
         return []
 
@@ -290,18 +637,19 @@ class Transaction():
         '''
 
         for tx in self.transfers or []:
-            if tx.type in {'ERC721', 'ERC20'}:
+            if tx.type in TOKEN_TYPES:
                 return (tx._from, tx._to, tx.token, tx.amount)
 
         return ()
 
     def emits_illegal_events(self, address: str, sig: str) -> str:
-        for event in self.events:
-            if event.address != address and event.signature == sig:
+        for event in self.get_events(event_sig=sig):
+            if event.address != address:
                 return event.address
 
 
 class SrcEvents(Enum):
+    TRANSFERID = "transferId"
     DSTCHAINID = "dstChainId"
     NONCE = "nonce"
     MAXSLIPPAGE = "maxSlippage"
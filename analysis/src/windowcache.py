@@ -0,0 +1,116 @@
+"""
+    Defines a cache of the destination candidates already loaded for block ranges, so that
+    the overlapping destination windows of nearby sends are only scanned once
+"""
+
+from bisect import insort
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Tuple
+
+
+class Segment():
+    """
+        A scanned block range, from start to end (inclusive), and the candidates found in it
+    """
+
+    __slots__ = ("start", "end", "items")
+
+    def __init__(self, start: int, end: int, items: list) -> None:
+        self.start = start
+        self.end = end
+        self.items = items
+
+    def __len__(self) -> int:
+        return max(1, len(self.items))
+
+
+class WindowCache():
+    """
+        Interval index of scanned block ranges per key, such as (chain, endpoint address). A
+        lookup only fetches the sub-ranges not covered yet, and the cache is bounded by an LRU
+        budget on the number of cached candidates (every range counting for at least one)
+
+        Params:
+        - budget: the maximum number of candidates to keep (default 10000)
+    """
+
+    def __init__(self, budget: int = 10000) -> None:
+        self.budget = budget
+        self.size = 0
+
+        # key -> segments sorted by start, never overlapping
+        self.segments: Dict[Hashable, List[Segment]] = {}
+        self.lru: OrderedDict[Tuple[Hashable, int], Segment] = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get(self, key: Hashable, start: int, end: int, fetch: Callable[[int, int], Tuple[list, bool]]) -> list:
+        '''
+            Returns the candidates of a block range, fetching the sub-ranges that are not cached
+
+            @param key : the key of the ranges, such as (chain, endpoint address)
+            @param start : the first block of the range
+            @param end : the last block of the range (inclusive)
+            @param fetch : called with (start, end) of each uncovered sub-range, returning its
+            candidates (each with a .block) and whether the range was scanned completely.
+            Incomplete ranges, such as those cut off by a query limit, are not cached
+
+            @returns the candidates of the range, ordered by block
+        '''
+        segments = self.segments.setdefault(key, [])
+
+        res = []
+        gaps = []
+        pos = start
+
+        for segment in segments:
+            if segment.end < start:
+                continue
+
+            if segment.start > end:
+                break
+
+            if segment.start > pos:
+                gaps.append((pos, segment.start - 1))
+
+            pos = max(pos, segment.end + 1)
+
+            res.extend(i for i in segment.items if start <= i.block <= end)
+            self.lru.move_to_end((key, segment.start))
+
+        if pos <= end:
+            gaps.append((pos, end))
+
+        for gap_start, gap_end in gaps:
+            items, complete = fetch(gap_start, gap_end)
+
+            res.extend(items)
+
+            if complete:
+                self.__add(key, Segment(gap_start, gap_end, items))
+
+        self.__evict()
+
+        return sorted(res, key=lambda i: i.block)
+
+    def __add(self, key: Hashable, segment: Segment) -> None:
+        insort(self.segments[key], segment, key=lambda i: i.start)
+
+        self.lru[(key, segment.start)] = segment
+        self.size += len(segment)
+
+    def __evict(self) -> None:
+        """
+            Drops the least recently used ranges until the cache is within its budget
+        """
+        while self.size > self.budget and len(self.lru) > 0:
+            (key, _), segment = self.lru.popitem(last=False)
+
+            self.segments[key].remove(segment)
+            self.size -= len(segment)
+
+    def clear(self) -> None:
+        self.segments = {}
+        self.lru = OrderedDict()
+        self.size = 0